@@ -0,0 +1,45 @@
+"""
+Compare two result files written by benchmarks/run.py.
+
+    python benchmarks/compare.py baseline.json results.json --threshold 1.2
+
+Exits with status 1 if any stage is slower than the threshold ratio.
+"""
+from argparse import ArgumentParser
+import json
+import sys
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("baseline")
+    parser.add_argument("results")
+    parser.add_argument("--threshold", type=float, default=None, help="Fail if a stage takes more than this multiple of the baseline time.")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.results) as f:
+        results = json.load(f)
+
+    if baseline["params"] != results["params"]:
+        print("warning: results were generated with different parameters", file=sys.stderr)
+
+    print(f"{'stage':<24} {'before':>10} {'after':>10} {'ratio':>7} {'MB before':>10} {'MB after':>10}")
+    regressed = []
+    for name, after in results["stages"].items():
+        before = baseline["stages"].get(name)
+        if before is None:
+            print(f"{name:<24} {'-':>10} {after['seconds']:>9.4f}s {'-':>7} {'-':>10} {after['peak_bytes'] / 1e6:>10.1f}")
+            continue
+        ratio = after["seconds"] / before["seconds"] if before["seconds"] > 0 else float("inf")
+        print(f"{name:<24} {before['seconds']:>9.4f}s {after['seconds']:>9.4f}s {ratio:>7.2f} "
+              f"{before['peak_bytes'] / 1e6:>10.1f} {after['peak_bytes'] / 1e6:>10.1f}")
+        if args.threshold is not None and ratio > args.threshold:
+            regressed.append(name)
+
+    if len(regressed) > 0:
+        print(f"slower than {args.threshold}x baseline: {', '.join(regressed)}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Deterministic generator for large synthetic .budget files.
+
+    python benchmarks/generate.py --lines 100000 --depth 4 --fanout 8 \
+        --quoted-ratio 0.3 --seed 1 > large.budget
+
+The same arguments always produce the same file.
+"""
+from argparse import ArgumentParser
+from collections.abc import Iterator
+import random
+import sys
+
+def category_path(rng: random.Random, depth: int, fanout: int, quoted: bool) -> str:
+    length = rng.randint(1, depth)
+    separator = " " if quoted else "_"
+    parts = [ f"Cat{separator}{level}{separator}{rng.randrange(fanout)}" for level in range(length) ]
+    return ":".join(parts)
+
+def lines(
+        count: int,
+        depth: int = 3,
+        fanout: int = 10,
+        quoted_ratio: float = 0.2,
+        income_ratio: float = 0.1,
+        seed: int = 0,
+        width: int = 80
+) -> Iterator[str]:
+    """
+    Yields `count` budget lines, each ending in a newline.
+
+    Category paths are 1 to `depth` levels deep with `fanout` possible names
+    per level. `quoted_ratio` of them contain spaces and are quoted.
+    """
+    rng = random.Random(seed)
+    for _ in range(count):
+        quoted = rng.random() < quoted_ratio
+        account = category_path(rng, depth, fanout, quoted)
+        if quoted:
+            account = f"\"{account}\""
+        sign = "+" if rng.random() < income_ratio else "-"
+        left = f"{sign} {account}"
+        right = str(rng.randint(1, 1000000))
+        spacer = " " * max(1, width - (len(left) + len(right)))
+        yield f"{left}{spacer}{right}\n"
+
+def write(filename: str, count: int, **kwargs):
+    with open(filename, "w") as f:
+        f.writelines(lines(count, **kwargs))
+
+def main():
+    parser = ArgumentParser(description="Write a synthetic .budget file to stdout.")
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--depth", type=int, default=3, help="Maximum category depth.")
+    parser.add_argument("--fanout", type=int, default=10, help="Number of distinct names at each level.")
+    parser.add_argument("--quoted-ratio", type=float, default=0.2, help="Fraction of accounts which are quoted.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    sys.stdout.writelines(lines(args.lines, args.depth, args.fanout, args.quoted_ratio, seed=args.seed))
+
+if __name__ == "__main__":
+    main()
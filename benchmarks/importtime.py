@@ -0,0 +1,68 @@
+"""
+Startup regression check for the minibudget CLI.
+
+Runs each command below under `python -X importtime` and fails if it imports
+a dependency it has no use for, or if importing the CLI takes longer than
+--max-ms. Run from the repository root:
+
+    python benchmarks/importtime.py
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+import subprocess
+import sys
+
+EXAMPLE = str(Path(__file__).parent.parent / "budgets" / "example.budget")
+
+# (command line, top-level modules it must not import)
+CHECKS = [
+    ([], {"plotly", "rich", "jinja2", "beanquery", "concurrent"}),
+    (["report", EXAMPLE, "--no-cache"], {"plotly", "jinja2", "beanquery", "concurrent"}),
+    (["diff", EXAMPLE, EXAMPLE, "--no-cache", "--output", "csv"], {"plotly", "rich", "jinja2", "beanquery", "concurrent"}),
+    (["diff", EXAMPLE, EXAMPLE, "--no-cache", "--output", "html"], {"plotly", "rich", "beanquery", "concurrent"}),
+]
+
+def imported_modules(argv: list[str]) -> tuple[dict[str, int], int]:
+    """
+    Returns the cumulative import time in microseconds of every module
+    imported by the command, and of the CLI module itself.
+    """
+    if len(argv) == 0:
+        command = [sys.executable, "-X", "importtime", "-c", "import minibudget.minibudget"]
+    else:
+        command = [sys.executable, "-X", "importtime", "-m", "minibudget.minibudget", *argv]
+    result = subprocess.run(command, capture_output=True, text=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        modules[name.strip()] = int(cumulative)
+    return modules, modules.get("minibudget.minibudget", 0)
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--max-ms", type=float, default=150, help="Maximum time to import the CLI module. Default is 150.")
+    args = parser.parse_args()
+
+    failed = False
+    for argv, forbidden in CHECKS:
+        modules, cli_us = imported_modules(argv)
+        label = " ".join(["minibudget"] + [ Path(a).name for a in argv ])
+        loaded = sorted({ name.split(".")[0] for name in modules } & forbidden)
+        if len(loaded) > 0:
+            failed = True
+            print(f"FAIL {label}: imported {', '.join(loaded)}")
+        else:
+            print(f"ok   {label}")
+        if len(argv) == 0:
+            print(f"     minibudget.minibudget imported in {cli_us / 1000:.1f}ms")
+            if cli_us / 1000 > args.max_ms:
+                failed = True
+                print(f"FAIL import time is over {args.max_ms}ms")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Round trip check for compiled budgets.
+
+Generates a budget with quoted accounts, compiles it, converts the compiled
+file back to text and fails unless parsing that text gives the same entries
+as parsing the original. Run from the repository root:
+
+    python benchmarks/roundtrip.py
+"""
+from argparse import ArgumentParser
+import contextlib
+import io
+from pathlib import Path
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+
+import generate
+from minibudget import compiled, convert, parse
+
+EXAMPLE = str(Path(__file__).parent.parent / "budgets" / "example.budget")
+
+def round_trip(source: str, folder: Path) -> bool:
+    target = str(folder / (Path(source).stem + compiled.SUFFIX))
+    text = str(folder / (Path(source).stem + ".roundtrip.budget"))
+    with contextlib.redirect_stderr(io.StringIO()):
+        compiled.compile_file(source, target)
+        with open(text, "w") as f:
+            f.write(convert.entry_list_to_string(compiled.load(target)) + "\n")
+        return parse.budget(source) == parse.budget(text)
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--lines", type=int, default=10000, help="Lines in the generated budget. Default is 10000.")
+    parser.add_argument("--quoted-ratio", type=float, default=0.2)
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as folder:
+        generated = str(Path(folder) / "generated.budget")
+        generate.write(generated, args.lines, quoted_ratio=args.quoted_ratio)
+        for source in (EXAMPLE, generated):
+            if round_trip(source, Path(folder)):
+                print(f"ok   {Path(source).name}")
+            else:
+                failed = True
+                print(f"FAIL {Path(source).name}: converting the compiled budget back to text changed its entries")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
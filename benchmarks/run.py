@@ -0,0 +1,195 @@
+"""
+Benchmark harness for minibudget.
+
+Generates synthetic budgets with benchmarks/generate.py, then times each
+pipeline stage and each command end to end. Peak memory is measured in a
+separate pass under tracemalloc so that it doesn't skew the timings.
+
+    python benchmarks/run.py --lines 100000 --periods 3 --output results.json
+    python benchmarks/compare.py baseline.json results.json
+
+Run it from the repository root, or with minibudget installed.
+"""
+from argparse import ArgumentParser
+from collections.abc import Callable
+import contextlib
+import csv
+import gc
+import json
+import os
+from pathlib import Path
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+
+import generate
+from minibudget import parse, render, transform
+from minibudget.minibudget import main as cli_main
+from minibudget.render import RenderOptions
+from minibudget.store import CategoryStore
+
+def version() -> str:
+    try:
+        from importlib.metadata import version as package_version
+        return package_version("minibudget")
+    except Exception:
+        return "unknown"
+
+class Harness:
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        self.results: dict[str, dict] = {}
+
+    def measure(self, name: str, fn: Callable):
+        """
+        Runs fn `repeat` times for timing and once more under tracemalloc,
+        returning the result of the last timed run.
+        """
+        runs = []
+        result = None
+        for _ in range(self.repeat):
+            result = None
+            gc.collect()
+            start = time.perf_counter()
+            result = fn()
+            runs.append(time.perf_counter() - start)
+
+        gc.collect()
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.results[name] = {
+            "seconds": min(runs),
+            "runs": runs,
+            "peak_bytes": peak
+        }
+        print(f"{name:<24} {min(runs):>9.4f}s {peak / 1e6:>10.1f}MB", file=sys.stderr)
+        return result
+
+def quiet(fn: Callable) -> Callable:
+    def run():
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            return fn()
+    return run
+
+def sunburst_figure(expense_dict):
+    # the same figure as chart sunburst
+    import plotly.graph_objects as go
+    id_list, parent_list, label_list, value_list = transform.generate_sunburst_lists(expense_dict)
+    return go.Figure(go.Sunburst(ids=id_list, labels=label_list, values=value_list, parents=parent_list, branchvalues="total"))
+
+def run_stages(harness: Harness, files: list[str], options: RenderOptions, chart: bool):
+    from rich.console import Console
+    names = [ Path(f).stem for f in files ]
+
+    entries = harness.measure("parse", quiet(lambda: parse.budget(files[0])))
+    harness.measure("category_dict", lambda: transform.generate_category_dict(entries))
+    # the same rollup held in flat arrays, as diff --stream uses, to compare
+    # its memory with category_dict's
+    harness.measure("category_store", lambda: CategoryStore.from_entries(entries))
+    report_data = harness.measure("report_data", lambda: transform.entries_to_report_data(entries))
+    harness.measure("render_report", quiet(lambda: render.report(report_data, options)))
+
+    file_entries = [ entries ] + [ quiet(lambda f=f: parse.budget(f))() for f in files[1:] ]
+    category_dicts = [ transform.generate_category_dict(e) for e in file_entries ]
+    diff_dict = harness.measure("diff_dict", lambda: transform.generate_diff_dict(category_dicts))
+
+    def diff_text():
+        with open(os.devnull, "w") as devnull:
+            Console(file=devnull).print(render.diff_tree(diff_dict, names, options))
+    def diff_csv():
+        with open(os.devnull, "w") as devnull:
+            csv.writer(devnull).writerows(render.diff_csv_rows(diff_dict, names, options))
+    def diff_html():
+        with open(os.devnull, "w") as devnull:
+            devnull.writelines(render.diff_html_stream(diff_dict, names, options))
+
+    harness.measure("render_diff_text", diff_text)
+    harness.measure("render_diff_csv", diff_csv)
+    harness.measure("render_diff_html", diff_html)
+
+    harness.measure("sunburst_lists", lambda: transform.generate_sunburst_lists(report_data.expense_dict))
+    if chart:
+        harness.measure("chart_figure", lambda: sunburst_figure(report_data.expense_dict))
+
+def run_end_to_end(harness: Harness, files: list[str], chart: bool):
+    cli = lambda *argv: quiet(lambda: cli_main([*argv]))
+    harness.measure("e2e_report", cli("report", files[0], "--no-cache"))
+    for output in ("text", "csv", "html"):
+        harness.measure(f"e2e_diff_{output}", cli("diff", *files, "--no-cache", "--output", output))
+    harness.measure("e2e_diff_stream", cli("diff", *files, "--no-cache", "--output", "csv", "--stream"))
+    if chart:
+        # written to a file, as the chart command otherwise opens a browser
+        chart_file = str(Path(files[0]).with_suffix(".html"))
+        harness.measure("e2e_chart", cli("chart", "sunburst", files[0], "--no-cache", "--output", chart_file))
+
+def main():
+    parser = ArgumentParser(description="Time and measure memory for each minibudget pipeline stage.")
+    parser.add_argument("--lines", type=int, default=100000, help="Lines per generated budget file.")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--quoted-ratio", type=float, default=0.2)
+    parser.add_argument("--periods", type=int, default=3, help="Number of budget files to diff.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage; the fastest is reported.")
+    parser.add_argument("--stages", choices=["all", "pipeline", "e2e"], default="all")
+    parser.add_argument("--no-chart", dest="chart", action="store_false", help="Skip stages which need plotly.")
+    parser.add_argument("--label", default="", help="Free text stored with the results, e.g. a git revision.")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    if args.periods < 2:
+        raise ValueError("Must have at least 2 periods to benchmark diff.")
+
+    harness = Harness(args.repeat)
+    options = RenderOptions(None, "{neg}${amount}", 2)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        files = []
+        for period in range(args.periods):
+            filename = str(Path(workdir) / f"period-{period}.budget")
+            generate.write(filename,
+                           args.lines,
+                           depth=args.depth,
+                           fanout=args.fanout,
+                           quoted_ratio=args.quoted_ratio,
+                           seed=args.seed + period)
+            files.append(filename)
+
+        if args.stages in ("all", "pipeline"):
+            run_stages(harness, files, options, args.chart)
+        if args.stages in ("all", "e2e"):
+            run_end_to_end(harness, files, args.chart)
+
+    output = {
+        "minibudget": version(),
+        "label": args.label,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "lines": args.lines,
+            "depth": args.depth,
+            "fanout": args.fanout,
+            "quoted_ratio": args.quoted_ratio,
+            "periods": args.periods,
+            "seed": args.seed,
+            "repeat": args.repeat
+        },
+        "stages": harness.results
+    }
+    if args.output is None:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+
+if __name__ == "__main__":
+    main()
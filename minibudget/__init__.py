@@ -0,0 +1,3 @@
+from minibudget.budget import Budget, BudgetSet
+
+__all__ = ["Budget", "BudgetSet"]
@@ -0,0 +1,181 @@
+from collections.abc import Callable, Iterable
+from pathlib import Path
+import threading
+from typing import Any, Union
+from minibudget import transform
+from minibudget.matrix import DiffMatrix
+from minibudget.model import Entry, ReportData
+from minibudget.selection import CategorySelector
+
+class Budget:
+    """
+    The entries of one budget, with everything computed from them.
+
+    Category dicts, totals, report data and chart lists are computed the
+    first time they're asked for and remembered until entries are added, so
+    asking again costs nothing. A Budget can be shared between threads:
+    each value is computed once even if several threads ask for it at the
+    same time.
+
+    Returned values are shared with later callers, so treat them as read
+    only.
+
+        budget = Budget.from_file("2024-11.budget")
+        budget.total_unassigned
+        budget.expense_dict["Essential:Food"].amount
+    """
+    def __init__(self, entries: Iterable[Entry] = (), name: Union[str, None] = None):
+        self.name = name
+        self._entries = list(entries)
+        self._lock = threading.RLock()
+        self._memo: dict[Any, Any] = {}
+        # counts changes, so a BudgetSet can tell when its members change
+        self.version = 0
+
+    @classmethod
+    def from_file(cls, filename: str, selector: Union[CategorySelector, None] = None) -> "Budget":
+        """
+        Loads a .budget or .budgetc file. The budget is named after the file.
+        """
+        from minibudget import cache
+        return cls(cache.budget(filename, selector), Path(filename).stem)
+
+    def _cached(self, key: Any, compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key not in self._memo:
+                self._memo[key] = compute()
+            return self._memo[key]
+
+    def add(self, entry: Entry):
+        self.extend([entry])
+
+    def extend(self, entries: Iterable[Entry]):
+        entries = list(entries)
+        with self._lock:
+            self._entries.extend(entries)
+            self._memo.clear()
+            self.version += 1
+
+    @property
+    def entries(self) -> list[Entry]:
+        # a copy, so adding entries later doesn't change it
+        with self._lock:
+            return list(self._entries)
+
+    def _partition(self) -> tuple[list[Entry], list[Entry]]:
+        return self._cached("partition", lambda: transform.partition_entries(self._entries))
+
+    @property
+    def income_dict(self) -> dict[str, Entry]:
+        return self._cached("income_dict", lambda: transform.generate_category_dict(self._partition()[0]))
+
+    @property
+    def expense_dict(self) -> dict[str, Entry]:
+        return self._cached("expense_dict", lambda: transform.generate_category_dict(self._partition()[1]))
+
+    @property
+    def category_dict(self) -> dict[str, Entry]:
+        """
+        Income and expenses rolled up together, as compared by diff.
+        """
+        return self._cached("category_dict", lambda: transform.generate_category_dict(self._entries))
+
+    @property
+    def total_income(self) -> int:
+        return self._cached("total_income", lambda: transform.calculate_total(self._partition()[0]))
+
+    @property
+    def total_expenses(self) -> int:
+        return self._cached("total_expenses", lambda: transform.calculate_total(self._partition()[1]))
+
+    @property
+    def total_unassigned(self) -> int:
+        return self.total_income + self.total_expenses
+
+    @property
+    def report_data(self) -> ReportData:
+        def compute():
+            return ReportData(
+                self.entries,
+                self.total_income,
+                self.income_dict,
+                self.total_expenses,
+                self.expense_dict,
+                self.total_unassigned
+            )
+        return self._cached("report_data", compute)
+
+    @property
+    def triple_list(self) -> tuple[list[str], list[str], list[int]]:
+        """
+        transform.generate_triple_list for the expenses.
+        """
+        return self._cached("triple_list", lambda: transform.generate_triple_list(self._partition()[1]))
+
+    def sunburst_lists(
+            self,
+            top: Union[int, None] = None,
+            min_share: Union[float, None] = None
+    ) -> tuple[list[str], list[str], list[str], list[int]]:
+        """
+        transform.generate_sunburst_lists for the expenses.
+        """
+        return self._cached(("sunburst_lists", top, min_share),
+                            lambda: transform.generate_sunburst_lists(self.expense_dict, top, min_share))
+
+class BudgetSet:
+    """
+    Several budgets compared period by period, like minibudget diff.
+
+    The diff dict and matrix are remembered until a budget is added to the
+    set, or entries are added to one of its budgets.
+
+        budgets = BudgetSet.from_files(["2024-11.budget", "2024-12.budget"])
+        budgets.diff_matrix.diffs
+    """
+    def __init__(self, budgets: Iterable[Budget] = ()):
+        self._budgets = list(budgets)
+        self._lock = threading.RLock()
+        # key -> (budget versions when computed, value)
+        self._memo: dict[Any, tuple[tuple[int, ...], Any]] = {}
+
+    @classmethod
+    def from_files(cls, filenames: Iterable[str], selector: Union[CategorySelector, None] = None) -> "BudgetSet":
+        return cls(Budget.from_file(filename, selector) for filename in filenames)
+
+    def _cached(self, key: Any, compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            versions = tuple(budget.version for budget in self._budgets)
+            memo = self._memo.get(key)
+            if memo is None or memo[0] != versions:
+                memo = (versions, compute())
+                self._memo[key] = memo
+            return memo[1]
+
+    def add(self, budget: Budget):
+        with self._lock:
+            self._budgets.append(budget)
+            self._memo.clear()
+
+    def __len__(self) -> int:
+        return len(self._budgets)
+
+    def __getitem__(self, index: int) -> Budget:
+        return self._budgets[index]
+
+    @property
+    def budgets(self) -> list[Budget]:
+        with self._lock:
+            return list(self._budgets)
+
+    @property
+    def names(self) -> list[Union[str, None]]:
+        return [ budget.name for budget in self.budgets ]
+
+    @property
+    def diff_dict(self) -> dict[str, list[Union[Entry, None]]]:
+        return self._cached("diff_dict", lambda: transform.generate_diff_dict([ budget.category_dict for budget in self._budgets ]))
+
+    @property
+    def diff_matrix(self) -> DiffMatrix:
+        return self._cached("diff_matrix", lambda: DiffMatrix.from_diff_dict(self.diff_dict))
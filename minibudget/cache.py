@@ -0,0 +1,210 @@
+import contextlib
+import hashlib
+import io
+import os
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+from typing import Union
+from minibudget import compiled
+from minibudget import parse
+from minibudget import transform
+from minibudget.model import Entry, ReportData
+from minibudget.selection import CategorySelector
+from minibudget.store import CategoryStore
+
+# Bump when the stored layout changes so stale files are never read back.
+CACHE_VERSION = 1
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+def directory() -> Path:
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "minibudget"
+
+def _key(kind: str, filename: str) -> Union[str, None]:
+    # Path plus mtime and size identifies a file version without reading it,
+    # which is what lets warm runs skip the file entirely.
+    try:
+        path = Path(filename).resolve()
+        stat = path.stat()
+    except OSError:
+        return None
+    raw = f"{CACHE_VERSION}\0{kind}\0{path}\0{stat.st_mtime_ns}\0{stat.st_size}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _read(key: str):
+    path = directory() / key
+    try:
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        # mark as recently used for eviction
+        os.utime(path)
+    except Exception:
+        return None
+    return data
+
+def _write(key: str, data):
+    cache_dir = directory()
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_dir / key)
+        evict(MAX_CACHE_BYTES)
+    except OSError:
+        # a read-only or full cache should never stop a report
+        pass
+
+def evict(max_bytes: int):
+    """
+    Delete least recently used cache files until the cache fits in max_bytes.
+    """
+    files = []
+    for path in directory().iterdir():
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        files.append((stat.st_mtime_ns, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        with contextlib.suppress(OSError):
+            path.unlink()
+        total -= size
+
+def _entry_to_tuple(entry: Entry) -> tuple:
+    return (entry.categories, entry.is_income, entry.is_calculated, entry.amount, entry.children)
+
+def _parse(filename: str) -> tuple[list[Entry], str]:
+    # errors are kept alongside each rollup so that a cached file reports
+    # the same problems as a fresh parse
+    errors = io.StringIO()
+    entries = parse.budget(filename, errors=errors)
+    return entries, errors.getvalue()
+
+def budget(filename: str, selector: Union[CategorySelector, None] = None) -> list[Entry]:
+    """
+    Loads the entries of a .budget or .budgetc file. Entries aren't cached:
+    unpickling and rebuilding every entry takes longer than parsing the file
+    again, so only rollups of them are.
+    """
+    if compiled.is_compiled(filename):
+        return compiled.load(filename, selector)
+    return parse.budget(filename, selector)
+
+def _report_data(entries: list[Entry]) -> ReportData:
+    # like shard.Rollup.report_data, nothing rendered or exported from a
+    # report needs the entries themselves, so they aren't kept
+    data = transform.entries_to_report_data(entries)
+    data.entries = []
+    return data
+
+def _dict_rows(category_dict: dict[str, Entry]) -> list[tuple]:
+    return [ (k, _entry_to_tuple(e)) for k, e in category_dict.items() ]
+
+def _dict_from_rows(rows: list[tuple]) -> dict[str, Entry]:
+    return { k: Entry(*row) for k, row in rows }
+
+def _report_rows(data: ReportData) -> tuple:
+    return (data.total_income, _dict_rows(data.income_dict), data.total_expenses, _dict_rows(data.expense_dict))
+
+def _report_from_rows(rows: tuple) -> ReportData:
+    total_income, income_rows, total_expenses, expense_rows = rows
+    return ReportData(
+        [],
+        total_income,
+        _dict_from_rows(income_rows),
+        total_expenses,
+        _dict_from_rows(expense_rows),
+        total_income + total_expenses
+    )
+
+# Each kind of cached rollup, as how it's worked out from entries, how it's
+# stored, and how it's read back.
+ROLLUPS = {
+    "report": (_report_data, _report_rows, _report_from_rows),
+    "categories": (transform.generate_category_dict, _dict_rows, _dict_from_rows),
+    "store": (CategoryStore.from_entries, lambda store: store, lambda store: store)
+}
+
+def _rollups(filename: str, use_cache: bool, kinds: list[str]) -> list:
+    """
+    Rollups of a .budget file, read from the cache where they're all there.
+    Otherwise the file is parsed once for all of them, and the ones which
+    weren't cached are written back.
+    """
+    keys = [ _key(kind, filename) if use_cache else None for kind in kinds ]
+    cached = [ _read(key) if key is not None else None for key in keys ]
+    if all(hit is not None for hit in cached):
+        # every rollup of a file keeps the same errors
+        print(cached[0][1], end="", file=sys.stderr)
+        return [ ROLLUPS[kind][2](rows) for kind, (rows, _) in zip(kinds, cached) ]
+
+    entries, errors = _parse(filename)
+    print(errors, end="", file=sys.stderr)
+    outputs = []
+    for kind, key, hit in zip(kinds, keys, cached):
+        compute, to_rows, _ = ROLLUPS[kind]
+        output = compute(entries)
+        if key is not None and hit is None:
+            _write(key, (to_rows(output), errors))
+        outputs.append(output)
+    return outputs
+
+def report_data(
+        filename: str,
+        use_cache: bool = True,
+        selector: Union[CategorySelector, None] = None
+) -> ReportData:
+    """
+    A cached version of transform.entries_to_report_data for a budget file,
+    without the entries. With a selector, only selected entries are rolled
+    up, and the result isn't cached.
+    """
+    if compiled.is_compiled(filename) or selector != None:
+        return _report_data(budget(filename, selector))
+    return _rollups(filename, use_cache, ["report"])[0]
+
+def category_dict(
+        filename: str,
+        use_cache: bool = True,
+        selector: Union[CategorySelector, None] = None
+) -> dict[str, Entry]:
+    """
+    A cached version of transform.generate_category_dict for a budget file.
+    With a selector, only selected entries are rolled up.
+    """
+    if compiled.is_compiled(filename):
+        return transform.generate_category_dict(compiled.load_latest(filename, selector))
+    if selector != None:
+        return transform.generate_category_dict(parse.budget(filename, selector))
+    return _rollups(filename, use_cache, ["categories"])[0]
+
+def category_store(
+        filename: str,
+        use_cache: bool = True,
+        selector: Union[CategorySelector, None] = None
+) -> CategoryStore:
+    """
+    Like category_dict, but rolled up into a CategoryStore, which takes much
+    less memory than a dict of entries.
+    """
+    if compiled.is_compiled(filename):
+        return CategoryStore.from_entries(compiled.load_latest(filename, selector))
+    if selector != None:
+        return CategoryStore.from_entries(parse.budget(filename, selector))
+    return _rollups(filename, use_cache, ["store"])[0]
+
+def rollups(filename: str, use_cache: bool = True) -> tuple[ReportData, dict[str, Entry]]:
+    """
+    report_data and category_dict for the same file, parsing it at most once.
+    """
+    if compiled.is_compiled(filename):
+        entries = compiled.load(filename)
+        return _report_data(entries), transform.generate_category_dict(entries)
+    data, categories = _rollups(filename, use_cache, ["report", "categories"])
+    return data, categories
@@ -0,0 +1,142 @@
+from collections.abc import Callable
+import gc
+import mmap
+import struct
+from typing import Union
+from minibudget import parse
+from minibudget.model import Entry
+
+# A compiled budget (.budgetc) holds the same entries as a .budget file, in a
+# form which can be loaded without tokenising anything:
+#
+#   header      magic, format version, category count, record count
+#   categories  for each category, its length in bytes then its UTF-8 path
+#               with categories joined by ":"
+#   padding     to the next multiple of 8 bytes
+#   records     one fixed-width (category id, sign, units) record per entry
+#
+# All numbers are little endian. sign is 1 for income and 0 for expenses, and
+# units is the amount as written in the budget, so an entry's amount is units
+# for income and -units for expenses.
+MAGIC = b"MBUDGETC"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQ")
+LENGTH = struct.Struct("<I")
+RECORD = struct.Struct("<IB3xq")
+SUFFIX = ".budgetc"
+
+def is_compiled(filename: str) -> bool:
+    try:
+        with open(filename, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+def dumps(entries: list[Entry]) -> bytes:
+    ids: dict[str, int] = {}
+    records = []
+    for entry in entries:
+        key = ":".join(entry.categories)
+        category_id = ids.setdefault(key, len(ids))
+        units = entry.amount if entry.is_income else -entry.amount
+        try:
+            records.append(RECORD.pack(category_id, entry.is_income, units))
+        except struct.error:
+            raise ValueError(f"{key} has an amount of {entry.amount}, which is too large to compile.")
+
+    parts = [ HEADER.pack(MAGIC, VERSION, len(ids), len(records)) ]
+    size = HEADER.size
+    for key in ids:
+        encoded = key.encode("utf-8")
+        parts.append(LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+        size += LENGTH.size + len(encoded)
+    parts.append(bytes(_align(size) - size))
+    parts.extend(records)
+    return b"".join(parts)
+
+def compile_file(source: str, target: str) -> int:
+    """
+    Compiles the budget file `source` to `target`. Lines which can't be
+    parsed are reported and left out, as they are by parse.budget. Returns
+    the number of entries compiled.
+    """
+    entries = parse.budget(source)
+    data = dumps(entries)
+    with open(target, "wb") as f:
+        f.write(data)
+    return len(entries)
+
+def _read(
+        filename: str,
+        read_records: Callable[[list[Union[list[str], None]], memoryview], list[Entry]],
+        selector: Union[Callable[[str], bool], None] = None
+) -> list[Entry]:
+    with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if len(data) < HEADER.size:
+            raise ValueError(f"{filename} is not a compiled budget.")
+        magic, version, category_count, record_count = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a compiled budget.")
+        if version != VERSION:
+            raise ValueError(f"{filename} is compiled budget version {version}, but only version {VERSION} can be read. Compile it again.")
+
+        # see parse.budget
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            offset = HEADER.size
+            # categories which aren't selected are None, and their records
+            # are skipped
+            categories: list[Union[list[str], None]] = []
+            for _ in range(category_count):
+                (length,) = LENGTH.unpack_from(data, offset)
+                offset += LENGTH.size
+                path = data[offset:offset + length].decode("utf-8")
+                categories.append(path.split(":") if selector is None or selector(path) else None)
+                offset += length
+            offset = _align(offset)
+            end = offset + record_count * RECORD.size
+            if end > len(data):
+                raise ValueError(f"{filename} is truncated.")
+            with memoryview(data) as view, view[offset:end] as records:
+                return read_records(categories, records)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+def _all_records(categories: list[Union[list[str], None]], records: memoryview) -> list[Entry]:
+    return [
+        Entry(categories[category_id].copy(), sign == 1, False, units if sign else -units, [])
+        for category_id, sign, units in RECORD.iter_unpack(records)
+        if categories[category_id] is not None
+    ]
+
+def _latest_records(categories: list[Union[list[str], None]], records: memoryview) -> list[Entry]:
+    # ids are numbered in order of first appearance, so this keeps the order
+    # generate_category_dict would give the whole file
+    latest = { category_id: (sign, units) for category_id, sign, units in RECORD.iter_unpack(records) }
+    return [
+        Entry(categories[category_id], sign == 1, False, units if sign else -units, [])
+        for category_id, (sign, units) in latest.items()
+        if categories[category_id] is not None
+    ]
+
+def load(filename: str, selector: Union[Callable[[str], bool], None] = None) -> list[Entry]:
+    """
+    Loads the entries of a compiled budget, in the same order and with the
+    same values as parse.budget on the file it was compiled from. With a
+    selector, only entries whose category path it accepts are loaded.
+    """
+    return _read(filename, _all_records, selector)
+
+def load_latest(filename: str, selector: Union[Callable[[str], bool], None] = None) -> list[Entry]:
+    """
+    Loads only the last entry for each category, which is all that
+    transform.generate_category_dict uses. Gives the same category dict as
+    load, while creating one entry per category instead of one per line.
+    """
+    return _read(filename, _latest_records, selector)
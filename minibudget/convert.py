@@ -2,24 +2,17 @@ import shutil
 import subprocess
 import csv
 import io
+from bisect import bisect_right
+from datetime import date, timedelta
 from typing import Union
-from minibudget.model import Entry
+from minibudget.model import Entry, Period
 from decimal import Decimal
 
-def beancount_to_entry(record: dict, currency: str) -> Union[Entry, None]:
-    amount = 0
-    found_currency = False
-    for key, val in record.items():
-        if len(val) == 0: continue
-        if currency in key: 
-            # since it's double-entry
-            # income and expenses are reversed
-            amount = Decimal(val) * -1
-            found_currency = True
-            break
-    if not found_currency:
-        return None
-    categories = record["account"].split(":")
+def _number_to_entry(account: str, number: Decimal) -> Entry:
+    # since it's double-entry
+    # income and expenses are reversed
+    amount = number * -1
+    categories = account.split(":")
     return Entry(
         categories=categories[1:],
         is_calculated=False,
@@ -29,10 +22,14 @@ def beancount_to_entry(record: dict, currency: str) -> Union[Entry, None]:
         children=[]
     )
 
-def beancount(file: str, currency: str, start: str, end: str) -> list[Entry]:
-    # Validate bean-query is in PATH
-    if shutil.which("bean-query") == None:
-        raise EnvironmentError("bean-query could not be found. Please make sure it's installed in your environment and try again.")
+def beancount_to_entry(record: dict, currency: str) -> Union[Entry, None]:
+    for key, val in record.items():
+        if len(val) == 0: continue
+        if currency in key:
+            return _number_to_entry(record["account"], Decimal(val))
+    return None
+
+def _query(start: Union[str, None], end: Union[str, None]) -> str:
     date_part = ""
     date_inner = []
     if start != None:
@@ -41,24 +38,167 @@ def beancount(file: str, currency: str, start: str, end: str) -> list[Entry]:
         date_inner.append(f"date <= {end}")
     if start != None or end != None:
         date_part = f" and ( { ' and '.join(date_inner) } )"
+    return f"select account, sum(position) where (account ~ 'Expenses' or account ~ 'Income' ) {date_part} group by account order by account"
+
+def beancount_library_available() -> bool:
+    try:
+        import beanquery
+    except ImportError:
+        return False
+    return True
+
+def _bean_query_records(file: str, start: Union[str, None], end: Union[str, None]) -> tuple[list[str], list[dict]]:
+    # Validate bean-query is in PATH
+    if shutil.which("bean-query") == None:
+        raise EnvironmentError("bean-query could not be found. Please make sure it's installed in your environment and try again.")
     # Issue query to get chart of accounts
     output = subprocess.run(["bean-query",
                              file,
-                             f"select account, sum(position) where (account ~ 'Expenses' or account ~ 'Income' ) {date_part} group by account order by account",
+                             _query(start, end),
                              "--format",
                              "csv",
-                             "-m"], 
+                             "-m"],
                             capture_output=True)
     output_as_csv = csv.DictReader(io.StringIO(output.stdout.decode('utf-8')))
-    # Filter chart of accounts to the currency we care about
+    records = list(output_as_csv)
+    return (output_as_csv.fieldnames or []), records
+
+def _records_to_entries(fieldnames: list[str], records: list[dict], currency: str) -> list[Entry]:
+    # Filter chart of accounts to the currency we care about; the matching
+    # columns are the same for every record so only look them up once
+    columns = [ key for key in fieldnames if currency in key ]
     entries = []
-    for record in output_as_csv:
-        entry = beancount_to_entry(record, currency)
-        if entry is None: continue
-        entries.append(entry)
+    for record in records:
+        for column in columns:
+            val = record[column]
+            if len(val) == 0: continue
+            entries.append(_number_to_entry(record["account"], Decimal(val)))
+            break
     # Return accounts in minibudget format
     return entries
 
+def beancount_bean_query(file: str, currency: str, start: Union[str, None], end: Union[str, None]) -> list[Entry]:
+    fieldnames, records = _bean_query_records(file, start, end)
+    return _records_to_entries(fieldnames, records, currency)
+
+def beancount_library(file: str, currency: str, start: Union[str, None], end: Union[str, None]) -> list[Entry]:
+    """
+    Runs the same query as beancount_bean_query in this process with the
+    beanquery library, reading result rows directly instead of through CSV.
+    """
+    import beanquery
+    connection = beanquery.connect(f"beancount:{file}")
+    # bean-query -m rounds each number to the precision the ledger uses for
+    # its currency, which decides how many units an amount becomes
+    dformat = connection.options["dcontext"].build()
+    entries = []
+    for account, inventory in connection.execute(_query(start, end)):
+        number = inventory.get_currency_units(currency).number
+        if not number: continue
+        entries.append(_number_to_entry(account, dformat.quantize(number, currency)))
+    return entries
+
+def beancount(file: str, currency: str, start: str, end: str, backend: str = "auto") -> list[Entry]:
+    """
+    Converts income and expenses from a beancount ledger. `backend` is
+    "library" to use the beanquery package in this process, "bean-query" to
+    run the bean-query command, or "auto" to use the library if installed.
+    """
+    if backend == "auto":
+        backend = "library" if beancount_library_available() else "bean-query"
+    if backend == "library":
+        return beancount_library(file, currency, start, end)
+    if backend == "bean-query":
+        return beancount_bean_query(file, currency, start, end)
+    raise ValueError(f"{backend} is not a beancount backend.")
+
+def periods(start: date, end: date, length: str) -> list[Period]:
+    """
+    Splits start to end (inclusive) into calendar periods of `length`:
+    "monthly", "quarterly" or "yearly". The first and last periods are cut
+    short if start or end fall part way through one.
+    """
+    if length not in ("monthly", "quarterly", "yearly"):
+        raise ValueError(f"{length} is not a period length.")
+    if end < start:
+        raise ValueError("End date must not be before the start date.")
+    output = []
+    current = start
+    while current <= end:
+        if length == "monthly":
+            label = f"{current.year}-{current.month:02}"
+            months = 1
+        elif length == "quarterly":
+            label = f"{current.year}-Q{(current.month - 1) // 3 + 1}"
+            months = 3 - (current.month - 1) % 3
+        else:
+            label = f"{current.year}"
+            months = 13 - current.month
+        month_index = current.year * 12 + current.month - 1 + months
+        next_start = date(month_index // 12, month_index % 12 + 1, 1)
+        output.append(Period(label, current, min(next_start - timedelta(days=1), end)))
+        current = next_start
+    return output
+
+def beancount_library_batch(file: str, currencies: list[str], period_list: list[Period]) -> dict[tuple[str, str], list[Entry]]:
+    """
+    Converts every period and currency from a single load of the ledger and
+    a single pass over its income and expenses postings.
+    """
+    import beanquery
+    connection = beanquery.connect(f"beancount:{file}")
+    dformat = connection.options["dcontext"].build()
+    starts = [ period.start for period in period_list ]
+    wanted = set(currencies)
+    query = ("select date, account, units(position) where (account ~ 'Expenses' or account ~ 'Income' ) "
+             f"and ( date >= {period_list[0].start} and date <= {period_list[-1].end} )")
+
+    totals: dict[tuple[int, str], dict[str, Decimal]] = {}
+    for posted, account, units in connection.execute(query):
+        if units.currency not in wanted: continue
+        i = bisect_right(starts, posted) - 1
+        if i < 0 or posted > period_list[i].end: continue
+        accounts = totals.setdefault((i, units.currency), {})
+        accounts[account] = accounts.get(account, Decimal(0)) + units.number
+
+    output = {}
+    for i, period in enumerate(period_list):
+        for currency in currencies:
+            accounts = totals.get((i, currency), {})
+            output[(period.label, currency)] = [
+                _number_to_entry(account, dformat.quantize(accounts[account], currency))
+                for account in sorted(accounts) if accounts[account]
+            ]
+    return output
+
+def beancount_batch(file: str, currencies: list[str], period_list: list[Period], backend: str = "auto") -> dict[tuple[str, str], list[Entry]]:
+    """
+    Converts each period and currency pair, keyed by (period label, currency).
+    The bean-query backend can't keep the ledger loaded, so it runs one query
+    per period and reads every currency from it.
+    """
+    if backend == "auto":
+        backend = "library" if beancount_library_available() else "bean-query"
+    if backend == "library":
+        return beancount_library_batch(file, currencies, period_list)
+    if backend == "bean-query":
+        output = {}
+        for period in period_list:
+            fieldnames, records = _bean_query_records(file, period.start.isoformat(), period.end.isoformat())
+            for currency in currencies:
+                output[(period.label, currency)] = _records_to_entries(fieldnames, records, currency)
+        return output
+    raise ValueError(f"{backend} is not a beancount backend.")
+
+def account_to_string(categories: list[str]) -> str:
+    account = ":".join(categories)
+    if "\"" in account:
+        # the budget format has no way to escape a quote
+        raise ValueError(f"{account} contains a quote, which can't be written in a budget.")
+    if " " in account:
+        return f"\"{account}\""
+    return account
+
 def entry_list_to_string(entry_list: list[Entry], width = 80):
     str_list = []
     for entry in entry_list:
@@ -68,8 +208,9 @@ def entry_list_to_string(entry_list: list[Entry], width = 80):
             left += "+ "
         else:
             left += "- "
-        left += ":".join(entry.categories)
+        left += account_to_string(entry.categories)
         right += str(abs(entry.amount))
-        spacer = " " * (width - (len(left) + len(right)))
+        # at least one space, so long accounts don't run into their amount
+        spacer = " " * max(1, width - (len(left) + len(right)))
         str_list.append(f"{left}{spacer}{right}")
     return "\n".join(str_list)
@@ -0,0 +1,147 @@
+from array import array
+from collections.abc import Iterator, Sequence
+import json
+from typing import BinaryIO, TextIO, Union
+from minibudget import render
+from minibudget.helpers import entry_dict_index, walk
+from minibudget.matrix import DiffMatrix
+from minibudget.model import Entry, ReportData
+from minibudget.render import AggregateOptions
+
+# Exports write one row per category with raw integer amounts, for other
+# programs to load without parsing formatted currency back into numbers.
+# A table is a dict of column name to column, in the order they're written.
+FORMATS = ["jsonl", "arrow", "parquet"]
+BINARY_FORMATS = ["arrow", "parquet"]
+BATCH_ROWS = 1 << 16
+
+# the columns describing each category; every other column is an amount
+CATEGORY_COLUMNS = ["path", "depth", "parent", "is_income", "is_calculated"]
+
+def _parent(key: str) -> Union[str, None]:
+    cut = key.rfind(":")
+    return key[:cut] if cut != -1 else None
+
+def report_columns(data: ReportData) -> dict[str, Sequence]:
+    table = { name: [] for name in CATEGORY_COLUMNS }
+    table["amount"] = array("q")
+    for category_dict in (data.income_dict, data.expense_dict):
+        for key, depth in walk(entry_dict_index(category_dict)):
+            entry = category_dict[key]
+            table["path"].append(key)
+            table["depth"].append(depth)
+            table["parent"].append(_parent(key))
+            table["is_income"].append(entry.is_income)
+            table["is_calculated"].append(entry.is_calculated)
+            table["amount"].append(entry.amount)
+    return table
+
+def diff_columns(
+        tree: dict[str, list[Union[Entry, None]]],
+        names: list[str],
+        aggregates: Union[AggregateOptions, None] = None
+) -> dict[str, Sequence]:
+    """
+    One column per period named after it, then the same diff and aggregate
+    columns as diff --output csv. A category is calculated if it is
+    calculated in every period it appears in.
+    """
+    matrix = DiffMatrix.from_diff_dict(tree)
+    table: dict[str, Sequence] = {
+        "path": matrix.keys,
+        "depth": matrix.depths,
+        "parent": [ _parent(key) for key in matrix.keys ],
+        "is_income": [],
+        "is_calculated": []
+    }
+    for key in matrix.keys:
+        entries = [ entry for entry in tree[key] if entry != None ]
+        table["is_income"].append(entries[0].is_income)
+        table["is_calculated"].append(all(entry.is_calculated for entry in entries))
+
+    aggregate_list = render.aggregate_columns(matrix, names, aggregates)
+    columns = matrix.columns + matrix.diffs
+    for _, aggregate in aggregate_list:
+        columns.extend(aggregate)
+    # the csv header without its Category column
+    value_names = render.diff_csv_header(names, [ label for label, _ in aggregate_list ])[1:]
+    seen = set(CATEGORY_COLUMNS)
+    for name in value_names:
+        if name in seen:
+            # a column would silently replace another one
+            raise ValueError(f"Can't export two columns named {name}. Rename the budget files so their names are unique and aren't one of {', '.join(CATEGORY_COLUMNS)}.")
+        seen.add(name)
+    table.update(zip(value_names, columns))
+    return table
+
+def write_jsonl(table: dict[str, Sequence], out: TextIO):
+    names = list(table)
+    rows = zip(*table.values())
+    while True:
+        lines = [ json.dumps(dict(zip(names, row))) + "\n" for _, row in zip(range(BATCH_ROWS), rows) ]
+        if len(lines) == 0:
+            return
+        out.writelines(lines)
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ValueError("Arrow and Parquet output need pyarrow. Install minibudget with the export extras, e.g. pipx install \"minibudget[export]\", or add it with pipx inject minibudget pyarrow.")
+    return pyarrow
+
+def _arrow_type(pa, name: str):
+    if name in ("path", "parent"):
+        return pa.string()
+    if name == "depth":
+        return pa.int32()
+    if name in ("is_income", "is_calculated"):
+        return pa.bool_()
+    return pa.int64()
+
+def record_batches(table: dict[str, Sequence]) -> tuple["pyarrow.Schema", Iterator["pyarrow.RecordBatch"]]:
+    pa = _pyarrow()
+    schema = pa.schema([ (name, _arrow_type(pa, name)) for name in table ])
+    rows = len(next(iter(table.values()), []))
+
+    def column(values: Sequence, field) -> "pyarrow.Array":
+        if isinstance(values, array) and values.typecode == "q":
+            # 64 bit integer arrays are handed over without copying each value
+            return pa.Array.from_buffers(field.type, len(values), [None, pa.py_buffer(values)])
+        return pa.array(values, type=field.type)
+
+    def batches() -> Iterator["pyarrow.RecordBatch"]:
+        for start in range(0, rows, BATCH_ROWS):
+            stop = min(start + BATCH_ROWS, rows)
+            arrays = [ column(values[start:stop], field) for values, field in zip(table.values(), schema) ]
+            yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    return schema, batches()
+
+def write_arrow(table: dict[str, Sequence], out: BinaryIO):
+    """
+    Writes the Arrow IPC file format, also known as Feather version 2.
+    """
+    pa = _pyarrow()
+    schema, batches = record_batches(table)
+    with pa.ipc.new_file(out, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+def write_parquet(table: dict[str, Sequence], out: BinaryIO):
+    _pyarrow()
+    import pyarrow.parquet as pq
+    schema, batches = record_batches(table)
+    with pq.ParquetWriter(out, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+def write(table: dict[str, Sequence], format: str, text_out: TextIO, binary_out: BinaryIO):
+    if format == "jsonl":
+        write_jsonl(table, text_out)
+    elif format == "arrow":
+        write_arrow(table, binary_out)
+    elif format == "parquet":
+        write_parquet(table, binary_out)
+    else:
+        raise ValueError(f"{format} is not an export format.")
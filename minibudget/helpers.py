@@ -1,32 +1,62 @@
-from collections.abc import Callable
+from collections.abc import Callable, Iterator, Mapping
 from typing import Union
-from minibudget.model import Entry
-
-def _dft_entry_dict(entry_dict: dict[str, Entry], root: str, fn: Union[None, Callable]):
-    root_entry = entry_dict[root]
-    if fn != None:
-        fn(root_entry)
-    for child in root_entry.children:
-        _dft_entry_dict(entry_dict, child, fn)
-        
-def dft_entry_dict(entry_dict: dict[str, Entry], fn: Union[None, Callable] = None):
-    roots = [ key for key in entry_dict.keys() if len(key.split(":")) == 1 ]
-    for root in roots:
-        _dft_entry_dict( entry_dict, root, fn )
-
-def _dft_diff_dict(entry_dict: dict[str, list[Union[Entry, None]]], root: str, fn: Union[None, Callable]):
-    root_list = entry_dict[root]
-    if fn != None:
-        fn(root_list)
-    children = set()
-    for entry in root_list:
-        if entry == None:
+from minibudget.model import Entry, TreeIndex
+
+def entry_dict_index(entry_dict: Mapping[str, Entry]) -> TreeIndex:
+    roots = [ key for key in entry_dict.keys() if ":" not in key ]
+    children = { key: entry.children for key, entry in entry_dict.items() }
+    return TreeIndex(roots, children)
+
+def diff_dict_index(entry_dict: Mapping[str, list[Union[Entry, None]]]) -> TreeIndex:
+    roots = [ key for key in entry_dict.keys() if ":" not in key ]
+    children = {}
+    for key, entries in entry_dict.items():
+        # ordered union across periods: a child keeps the position it has in
+        # the first period that contains it
+        union: dict[str, None] = {}
+        for entry in entries:
+            if entry != None:
+                union.update(dict.fromkeys(entry.children))
+        children[key] = list(union)
+    return TreeIndex(roots, children)
+
+def walk(index: TreeIndex) -> Iterator[tuple[str, int]]:
+    """
+    Depth-first, pre-order walk over an index yielding (key, depth).
+
+    Uses an explicit stack of child iterators, so the depth of the tree is
+    not limited by the recursion limit.
+    """
+    stack = [ iter(index.roots) ]
+    children = index.children
+    while len(stack) > 0:
+        key = next(stack[-1], None)
+        if key is None:
+            stack.pop()
             continue
-        children.update(entry.children)
-    for child in children:
-        _dft_diff_dict(entry_dict, child, fn)
-
-def dft_diff_dict(entry_dict: dict[str, list[Union[Entry, None]]], fn: Union[None, Callable]):
-    roots = [ key for key in entry_dict.keys() if len(key.split(":")) == 1 ]
-    for root in roots:
-        _dft_diff_dict( entry_dict, root, fn )
+        yield key, len(stack) - 1
+        key_children = children.get(key)
+        if key_children:
+            stack.append(iter(key_children))
+
+def iter_entry_dict(entry_dict: Mapping[str, Entry], index: Union[TreeIndex, None] = None) -> Iterator[Entry]:
+    if index is None:
+        index = entry_dict_index(entry_dict)
+    for key, _ in walk(index):
+        yield entry_dict[key]
+
+def iter_diff_dict(entry_dict: Mapping[str, list[Union[Entry, None]]], index: Union[TreeIndex, None] = None) -> Iterator[list[Union[Entry, None]]]:
+    if index is None:
+        index = diff_dict_index(entry_dict)
+    for key, _ in walk(index):
+        yield entry_dict[key]
+
+def dft_entry_dict(entry_dict: Mapping[str, Entry], fn: Union[None, Callable] = None):
+    for entry in iter_entry_dict(entry_dict):
+        if fn != None:
+            fn(entry)
+
+def dft_diff_dict(entry_dict: Mapping[str, list[Union[Entry, None]]], fn: Union[None, Callable]):
+    for entries in iter_diff_dict(entry_dict):
+        if fn != None:
+            fn(entries)
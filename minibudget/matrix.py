@@ -0,0 +1,122 @@
+from array import array
+from collections.abc import Iterator, Mapping
+from itertools import repeat
+from operator import add, sub
+import re
+from typing import Union
+from minibudget.helpers import diff_dict_index, walk
+from minibudget.model import Entry, TreeIndex
+
+class DiffMatrix:
+    """
+    A dense categories x periods matrix built from generate_diff_dict output.
+
+    Rows are categories in depth-first order, ready to render top to bottom.
+    Each period is stored as one array("q") column, with missing categories
+    counted as 0, so differences and totals over several periods are
+    computed a whole column at a time.
+    """
+    def __init__(self, keys: list[str], depths: list[int], columns: list[array]):
+        self.keys = keys
+        self.depths = depths
+        self.columns = columns
+        # diffs[i] is period i + 1 minus period i
+        self.diffs = [ array("q", map(sub, after, before)) for before, after in zip(columns, columns[1:]) ]
+        self._prefix_sums: Union[list[array], None] = None
+
+    @classmethod
+    def from_diff_dict(
+            cls,
+            diff_dict: Mapping[str, list[Union[Entry, None]]],
+            index: Union[TreeIndex, None] = None
+    ) -> "DiffMatrix":
+        if index is None:
+            index = diff_dict_index(diff_dict)
+        periods = len(next(iter(diff_dict.values()), []))
+        keys = []
+        depths = []
+        columns = [ array("q") for _ in range(periods) ]
+        for key, depth in walk(index):
+            keys.append(key)
+            depths.append(depth)
+            for column, entry in zip(columns, diff_dict[key]):
+                column.append(0 if entry is None else entry.amount)
+        return cls(keys, depths, columns)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def periods(self) -> int:
+        return len(self.columns)
+
+    def rows(self) -> Iterator[tuple[str, int, tuple[int, ...], tuple[int, ...]]]:
+        """
+        Yields (key, depth, amounts, diffs) for each category in order.
+        """
+        diffs = zip(*self.diffs) if len(self.diffs) > 0 else repeat(())
+        return zip(self.keys, self.depths, zip(*self.columns), diffs)
+
+    def prefix_sums(self) -> list[array]:
+        """
+        prefix_sums()[i] is each category's total over periods 0 to i - 1, so
+        the total over any run of periods is a single subtraction.
+        """
+        if self._prefix_sums is None:
+            prefix = [ array("q", bytes(array("q").itemsize * len(self.keys))) ]
+            for column in self.columns:
+                prefix.append(array("q", map(add, prefix[-1], column)))
+            self._prefix_sums = prefix
+        return self._prefix_sums
+
+    def range_totals(self, start: int, stop: int) -> array:
+        """
+        Each category's total over periods start to stop - 1.
+        """
+        prefix = self.prefix_sums()
+        return array("q", map(sub, prefix[stop], prefix[start]))
+
+    def rolling_totals(self, window: int) -> list[array]:
+        """
+        For each period, each category's total over that period and the
+        window - 1 before it. Early periods total as many as there are.
+        """
+        if window < 1:
+            raise ValueError("Window must be 1 or more.")
+        return [ self.range_totals(max(0, i + 1 - window), i + 1) for i in range(self.periods) ]
+
+    def rolling_averages(self, window: int) -> list[list[int]]:
+        """
+        rolling_totals divided by the number of periods in each window,
+        rounded to the nearest unit.
+        """
+        return [
+            [ round(total / count) for total in totals ]
+            for count, totals in zip((min(i + 1, window) for i in range(self.periods)), self.rolling_totals(window))
+        ]
+
+    def year_to_date(self, starts: list[int]) -> list[array]:
+        """
+        For each period i, each category's total from period starts[i] to
+        period i, e.g. from the first period of the same year.
+        """
+        return [ self.range_totals(start, i + 1) for i, start in enumerate(starts) ]
+
+YEAR_PATTERN = re.compile(r"[0-9]{4}(?![0-9])")
+
+def year_starts(names: list[str]) -> list[int]:
+    """
+    For periods named like 2024-01 or 2024-Q1, the index of the first period
+    of each period's year. If any name doesn't start with a year, every
+    period starts from the first one instead.
+    """
+    years = [ YEAR_PATTERN.match(name) for name in names ]
+    if any(year is None for year in years):
+        return [0] * len(names)
+    starts = []
+    for i, year in enumerate(years):
+        if i > 0 and year.group() == years[i - 1].group():
+            starts.append(starts[-1])
+        else:
+            starts.append(i)
+    return starts
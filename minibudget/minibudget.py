@@ -1,23 +1,35 @@
 #!python
 from argparse import ArgumentParser
-from minibudget.parsers import ReportParser, DiffParser, ConvertParser, ChartParser
+from typing import Union
+from minibudget.parsers import ReportParser, DiffParser, ConvertParser, ChartParser, ServeParser, CompileParser
 
-def main():
+def main(argv: Union[list[str], None] = None):
     parser = ArgumentParser()
+    parser.add_argument("--profile", action="store_true", help="Print the time and number of calls of each stage of the command, and the peak memory of the process, to stderr.")
+    parser.add_argument("--profile-output", help="Write --profile results to this file as JSON instead of printing them.")
+    parser.add_argument("--profile-memory", action="store_true", help="With --profile, trace how much memory each stage allocates. This is precise but makes the command several times slower.")
+    parser.add_argument("--cprofile", help="Run the command under cProfile and write its stats to this file, for use with pstats or other viewers.")
     subparsers = parser.add_subparsers(required=True)
 
     to_use = (
         ReportParser,
         DiffParser,
         ConvertParser,
-        ChartParser
+        ChartParser,
+        ServeParser,
+        CompileParser
     )
     
     for p in to_use:
         p.setup(subparsers)
     
-    args = parser.parse_args()
-    args.func(args) 
+    args = parser.parse_args(argv)
+    profile = args.profile or args.profile_output != None or args.profile_memory
+    if profile or args.cprofile != None:
+        from minibudget import profiling
+        profiling.run(args.func, args, profile, args.profile_output, args.cprofile, args.profile_memory)
+    else:
+        args.func(args)
 
 if __name__ == "__main__":
     main()
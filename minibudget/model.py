@@ -1,7 +1,8 @@
 from dataclasses import dataclass
+from datetime import date
 from typing import Union
 
-@dataclass
+@dataclass(slots=True)
 class Entry:
     categories: list[str]
     is_income: bool
@@ -23,3 +24,14 @@ class DiffTreeNode:
     category_name: str
     category_totals: list[int] 
     children: dict[str, "DiffTreeNode"]
+
+@dataclass
+class TreeIndex:
+    roots: list[str]
+    children: dict[str, list[str]]
+
+@dataclass
+class Period:
+    label: str
+    start: date
+    end: date
@@ -1,5 +1,23 @@
 from minibudget.model import Entry
+from minibudget.selection import CategorySelector
+import gc
+import re
 import sys
+from collections.abc import Callable
+from typing import TextIO, Union
+
+# Files are read in blocks of this many characters and scanned with a single
+# regex pass per block rather than one Python call per character.
+BLOCK_SIZE = 1 << 20
+
+# Matches one whole line per match. The first alternative covers well-formed
+# lines (sign, bare or quoted account, units, optional trailing fields); any
+# other line falls through to the second alternative and is handed to line()
+# so that unusual input is tokenised and reported exactly as before.
+LINE_PATTERN = re.compile(
+    r' *([+-]) +(?:"([^"\n]+)"|([^ "\n]+)) +([0-9]+)(?: [^\n]*)?\n'
+    r'|([^\n]*)\n'
+)
 
 def tokenise_line(ln: str) -> list[str]:
     delimiter = "\""
@@ -19,7 +37,7 @@ def tokenise_line(ln: str) -> list[str]:
 
 def line(ln: str) -> Entry:
     fields = tokenise_line(ln)
-    
+
     if fields[0] not in "+-":
         raise ValueError("Only + and - are valid entries for a start of line.")
 
@@ -39,15 +57,141 @@ def line(ln: str) -> Entry:
         children=[]
     )
 
-def budget(filename: str):
-    entries: list[Entry] = []
-    with open(filename) as f:
-        for i, ln in enumerate(f):
-            try:
-                entry = line(ln)
+def _fallback(ln: str, i: int, errors: Union[TextIO, None] = None) -> Union[Entry, None]:
+    try:
+        return line(ln)
+    except Exception as err:
+        # looked up on each call rather than bound as a default, so that
+        # redirecting sys.stderr still works
+        if errors is None:
+            errors = sys.stderr
+        print(err,file=errors)
+        print(f"Couldn't parse line {i}; {ln}.", file=errors)
+        return None
+
+def block_lines(
+        text: str,
+        first_line: int = 0,
+        selector: Union[Callable[[str], bool], None] = None,
+        errors: Union[TextIO, None] = None
+) -> list[Union[Entry, None]]:
+    """
+    Like block, but returns one item per line with None for lines which
+    couldn't be parsed or weren't selected.
+    """
+    end = text.rfind("\n") + 1
+    found = LINE_PATTERN.findall(text, 0, end)
+    results = [
+        Entry((quoted or bare).split(":"), sign == "+", False, int(sign + amount), [])
+        if sign else _fallback(rest + "\n", i, errors)
+        for i, (sign, quoted, bare, amount, rest) in enumerate(found, first_line)
+    ]
+    if end < len(text):
+        results.append(_fallback(text[end:], first_line + len(found), errors))
+    if selector != None:
+        results = [ entry if entry != None and selector(":".join(entry.categories)) else None for entry in results ]
+    return results
+
+def _search_block(
+        text: str,
+        first_line: int,
+        selector: CategorySelector,
+        errors: Union[TextIO, None] = None
+) -> list[Entry]:
+    """
+    Parses only the lines which contain the literal start of one of the
+    selector's --only patterns. Other lines are never tokenised, so they
+    aren't checked for errors either.
+    """
+    end = text.rfind("\n") + 1
+    entries = []
+    line_number = first_line
+    counted = 0
+    position = 0
+    while True:
+        hit = selector.search.search(text, position, end)
+        if hit is None:
+            break
+        start = text.rfind("\n", 0, hit.start()) + 1
+        stop = text.find("\n", hit.start()) + 1
+        line_number += text.count("\n", counted, start)
+        counted = start
+        sign, quoted, bare, amount, rest = LINE_PATTERN.match(text, start, stop).groups()
+        if sign:
+            account = quoted or bare
+            if selector(account):
+                entries.append(Entry(account.split(":"), sign == "+", False, int(sign + amount), []))
+        else:
+            entry = _fallback(rest + "\n", line_number, errors)
+            if entry != None and selector(":".join(entry.categories)):
                 entries.append(entry)
-            except Exception as err:
-                print(err,file=sys.stderr)
-                print(f"Couldn't parse line {i}; {ln}.", file=sys.stderr) 
+        position = stop
+    if end < len(text) and selector.search.search(text, end) != None:
+        line_number += text.count("\n", counted, end)
+        entries.extend(entry for entry in block_lines(text[end:], line_number, selector, errors) if entry != None)
     return entries
 
+def block(
+        text: str,
+        first_line: int = 0,
+        selector: Union[CategorySelector, None] = None,
+        errors: Union[TextIO, None] = None
+) -> list[Entry]:
+    """
+    Parse a run of budget lines starting at line number `first_line`.
+
+    A trailing line with no newline is parsed as the final line of a file.
+    With a selector, only lines whose account it accepts become entries, and
+    the amounts of other lines are never read. Lines which can't be parsed
+    are reported to `errors`, which defaults to sys.stderr.
+    """
+    if selector != None and selector.search != None:
+        return _search_block(text, first_line, selector, errors)
+    end = text.rfind("\n") + 1
+    found = LINE_PATTERN.findall(text, 0, end)
+    if selector is None:
+        entries = [
+            Entry((quoted or bare).split(":"), sign == "+", False, int(sign + amount), [])
+            for sign, quoted, bare, amount, _ in found if sign
+        ]
+        well_formed = len(entries) == len(found)
+    else:
+        well_formed = all(line_match[0] for line_match in found)
+        entries = [
+            Entry((quoted or bare).split(":"), sign == "+", False, int(sign + amount), [])
+            for sign, quoted, bare, amount, _ in found if sign and selector(quoted or bare)
+        ]
+    if not well_formed or end < len(text):
+        # at least one line needs the slow path; go line by line so errors
+        # and entries keep their original line positions
+        return [ entry for entry in block_lines(text, first_line, selector, errors) if entry is not None ]
+    return entries
+
+def budget(
+        filename: str,
+        selector: Union[CategorySelector, None] = None,
+        errors: Union[TextIO, None] = None
+) -> list[Entry]:
+    entries: list[Entry] = []
+    # entries hold no reference cycles, so pausing the cyclic collector
+    # avoids repeated full scans while millions of them are allocated
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(filename) as f:
+            first_line = 0
+            remainder = ""
+            while True:
+                chunk = f.read(BLOCK_SIZE)
+                if not chunk:
+                    break
+                text = remainder + chunk
+                end = text.rfind("\n") + 1
+                entries.extend(block(text[:end], first_line, selector, errors))
+                first_line += text.count("\n", 0, end)
+                remainder = text[end:]
+            entries.extend(block(remainder, first_line, selector, errors))
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return entries
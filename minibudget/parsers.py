@@ -1,15 +1,27 @@
 import csv
+from functools import partial
 from os import stat
 import sys
-from minibudget import parse
 from minibudget import render
 from minibudget import transform
-from minibudget import convert
+from minibudget import cache
 from minibudget.render import RenderOptions
-from rich.console import Console
+from minibudget.model import Entry
+from minibudget.selection import CategorySelector
 from pathlib import Path
-from plotly import subplots
-import plotly.graph_objects as go
+from typing import Union
+
+# Heavy or optional dependencies (plotly, rich, jinja2, the beancount
+# converter, process pools) are imported inside the subcommands that use
+# them so that every other command starts quickly.
+
+def file_to_category_dict(
+        filename: str,
+        use_cache: bool = True,
+        selector: Union[CategorySelector, None] = None
+) -> dict[str, Entry]:
+    # module level so it can be pickled and sent to worker processes
+    return cache.category_dict(filename, use_cache, selector)
 
 class CommonParser:
     @staticmethod
@@ -25,7 +37,45 @@ class CommonParser:
                             type=int, 
                             default=2, 
                             help="Number of decimal places to display when rendering currency. E.g. 2 will render as $0.00, while 0 will render as $0.")
+        parser.add_argument("--plain",
+                            action="store_true",
+                            help="Render text output as plain fixed-width columns, which is much faster for large budgets. This is the default when output isn't a terminal.")
     
+    @staticmethod
+    def setup_cache_options(parser):
+        parser.add_argument("--no-cache",
+                            dest="use_cache",
+                            action="store_false",
+                            help="Always parse budget files instead of reusing results cached from earlier runs.")
+
+    @staticmethod
+    def setup_selection_options(parser):
+        parser.add_argument("--only",
+                            action="append",
+                            metavar="PATTERN",
+                            help="Only include categories matching this glob, and everything under them, e.g. Essential or \"*:Insurance\". Can be given more than once.")
+        parser.add_argument("--exclude",
+                            action="append",
+                            metavar="PATTERN",
+                            help="Leave out categories matching this glob, and everything under them. Can be given more than once.")
+
+    @staticmethod
+    def get_selector(args) -> Union[CategorySelector, None]:
+        if args.only is None and args.exclude is None:
+            return None
+        return CategorySelector(args.only, args.exclude)
+
+    @staticmethod
+    def use_plain(args) -> bool:
+        return args.plain or not sys.stdout.isatty()
+
+    @staticmethod
+    def export(table: dict, format: str):
+        from minibudget import export
+        if format in export.BINARY_FORMATS and sys.stdout.isatty():
+            raise ValueError(f"{format} output is binary. Redirect it to a file.")
+        export.write(table, format, sys.stdout, sys.stdout.buffer)
+
     @staticmethod
     def get_render_options(args) -> RenderOptions: 
         if args.currency_decimals < 0:
@@ -50,6 +100,10 @@ class ChartParser:
         chart_parser = parent_subparser.add_parser("chart",help="Generate charts based on minibudget files.")
         chart_parser.add_argument("type", choices=["sunburst"]) 
         chart_parser.add_argument("file")
+        chart_parser.add_argument("--top", type=int, help="Only show the N largest categories under each category, adding the rest together as \"Other\".")
+        chart_parser.add_argument("--min-share", type=float, help="Add categories smaller than this fraction of the total together as \"Other\", e.g. 0.01 for 1%%.")
+        chart_parser.add_argument("--output", help="Write the chart to this HTML file instead of opening it in a browser. The file works offline.")
+        CommonParser.setup_cache_options(chart_parser)
         chart_parser.set_defaults(func=ChartParser.chart)
 
     @staticmethod
@@ -62,9 +116,10 @@ class ChartParser:
 
     @staticmethod
     def donut(args):
+        from plotly import subplots
         if len(args.files) > 1:
             raise ValueError("Donut charts must be generated from a single file.")
-        entries = parse.budget(args.file)
+        entries = cache.budget(args.file)
         expense_entries = list(filter(lambda e: not e.is_income, entries))
         expense_dict = transform.generate_simple_dict(expense_entries)
         layout = subplots.make_subplots(specs=[[{"type":"pie"}]])
@@ -83,10 +138,15 @@ class ChartParser:
 
     @staticmethod
     def sunburst(args):
-        entries = parse.budget(args.file)
-        expense_entries = list(filter(lambda e: not e.is_income, entries))
-        parent_list, label_list, value_list = transform.generate_triple_list(expense_entries)
+        import plotly.graph_objects as go
+        if args.top != None and args.top < 1:
+            raise ValueError("Top must be 1 or more.")
+        if args.min_share != None and not 0 <= args.min_share < 1:
+            raise ValueError("Min share must be at least 0 and less than 1.")
+        expense_dict = cache.report_data(args.file, args.use_cache).expense_dict
+        id_list, parent_list, label_list, value_list = transform.generate_sunburst_lists(expense_dict, args.top, args.min_share)
         burst = go.Figure(go.Sunburst(
+            ids=id_list,
             labels=label_list, 
             values=value_list, 
             parents=parent_list, 
@@ -94,32 +154,94 @@ class ChartParser:
             textinfo="label",
             hoverinfo="label+value+percent entry"
         ))
-        burst.show()
+        if args.output != None:
+            burst.write_html(args.output, include_plotlyjs=True)
+            print(args.output)
+        else:
+            burst.show()
 
 class ReportParser:
     @staticmethod
     def setup(parent_subparser):
         report_parser = parent_subparser.add_parser("report", help="Report on a single .budget file.")
         CommonParser.setup_render_options(report_parser)
+        CommonParser.setup_cache_options(report_parser)
+        CommonParser.setup_selection_options(report_parser)
         report_parser.add_argument("file")
+        report_parser.add_argument("--watch", action="store_true", help="Keep the report open and update it whenever the file changes.")
+        report_parser.add_argument("--interval", type=float, default=0.5, help="How often to check the file for changes with --watch, in seconds. Default is 0.5.")
+        report_parser.add_argument("--jobs", type=int, default=1, help="Number of processes used to parse the budget file, each parsing part of it. Helps with files of millions of lines. Doesn't use the cache. Default is 1.")
+        report_parser.add_argument("--output", choices=["text","jsonl","arrow","parquet"], default="text", help="Output format. jsonl, arrow and parquet write each category with its raw integer amount for other programs to load. Default is text.")
         report_parser.set_defaults(func=ReportParser.report)
 
     @staticmethod
     def report(args): 
-        entries = parse.budget(args.file)
-        
-        report_data = transform.entries_to_report_data(entries)
+        if args.watch:
+            ReportParser.watch(args)
+            return
+
+        if args.jobs < 1:
+            raise ValueError("Jobs must be 1 or more.")
+
+        from minibudget import compiled
+        if args.jobs > 1 and not compiled.is_compiled(args.file):
+            from minibudget import shard
+            report_data = shard.rollup(args.file, args.jobs, CommonParser.get_selector(args)).report_data()
+        else:
+            report_data = cache.report_data(args.file, args.use_cache, CommonParser.get_selector(args))
         render_data = CommonParser.get_render_options(args)
 
-        render.report(report_data, render_data)
+        if args.output != "text":
+            from minibudget import export
+            CommonParser.export(export.report_columns(report_data), args.output)
+        elif CommonParser.use_plain(args):
+            render.report_plain(report_data, render_data, sys.stdout)
+        else:
+            render.report(report_data, render_data)
+
+    @staticmethod
+    def watch(args):
+        from rich.console import Console
+        from minibudget.watch import IncrementalReport
+        from minibudget import compiled
+        if args.interval <= 0:
+            raise ValueError("Interval must be more than 0.")
+        if args.output != "text":
+            raise ValueError("--watch only works with text output.")
+        if args.jobs != 1:
+            raise ValueError("--watch only parses the lines which change, so it can't be used with --jobs.")
+        if compiled.is_compiled(args.file):
+            raise ValueError("Compiled budgets can't be watched; watch the .budget file instead.")
+        render_data = CommonParser.get_render_options(args)
+        report = IncrementalReport(args.file, CommonParser.get_selector(args))
+        console = Console()
+        plain = CommonParser.use_plain(args)
+        try:
+            while True:
+                console.clear()
+                if plain:
+                    render.report_plain(report.report_data, render_data, sys.stdout)
+                    sys.stdout.flush()
+                else:
+                    render.report(report.report_data, render_data)
+                report.wait(args.interval)
+        except KeyboardInterrupt:
+            pass
 
 class DiffParser:
     @staticmethod
     def setup(parent_subparser):
         diff_parser = parent_subparser.add_parser("diff", help="See the difference between each category in several .budget files. Each file is considered one time period and differences are rolling between periods.")
         CommonParser.setup_render_options(diff_parser)
+        CommonParser.setup_cache_options(diff_parser)
+        CommonParser.setup_selection_options(diff_parser)
         diff_parser.add_argument("files", nargs="+")
-        diff_parser.add_argument("--output", choices=["text","csv","html"], default="text")
+        diff_parser.add_argument("--output", choices=["text","csv","html","jsonl","arrow","parquet"], default="text", help="Output format. jsonl, arrow and parquet write raw integer amounts for other programs to load. Default is text.")
+        diff_parser.add_argument("--jobs", type=int, default=1, help="Number of processes used to parse and roll up the budget files. Default is 1.")
+        diff_parser.add_argument("--rolling", type=int, action="append", metavar="N", help="Add each category's total over the last N periods to each period, e.g. 3, 6 or 12. Can be given more than once.")
+        diff_parser.add_argument("--average", type=int, action="append", metavar="N", help="Add each category's average over the last N periods to each period. Can be given more than once.")
+        diff_parser.add_argument("--ytd", action="store_true", help="Add each category's year to date total to each period. Years are read from file names like 2024-01.budget; otherwise totals run from the first file.")
+        diff_parser.add_argument("--stream", action="store_true", help="Hold one file's categories in memory at a time and merge them from a temporary file, for diffs over many files. Only for csv and html output.")
         diff_parser.set_defaults(func=DiffParser.diff)
 
     @staticmethod
@@ -128,22 +250,110 @@ class DiffParser:
         if len(args.files) < 2:
             raise ValueError("Must have at least 2 files to produce a diff.")
 
-        file_entries = [ parse.budget(filename) for filename in args.files ]
-        category_trees = [ transform.generate_category_dict(f) for f in file_entries]
+        if args.jobs < 1:
+            raise ValueError("Jobs must be 1 or more.")
+
+        aggregates = None
+        if args.rolling != None or args.average != None or args.ytd:
+            aggregates = render.AggregateOptions(args.rolling or [], args.average or [], args.ytd)
+            if any(window < 1 for window in aggregates.rolling + aggregates.averages):
+                raise ValueError("Rolling and average windows must be 1 or more.")
+
+        if args.stream:
+            DiffParser.diff_stream(args, render_data, aggregates)
+            return
+
+        category_trees = DiffParser.category_trees(args.files, args.jobs, args.use_cache, CommonParser.get_selector(args))
         diff_tree = transform.generate_diff_dict(category_trees)
         names = [ Path(f).stem for f in args.files ]
 
-        if args.output == "text":
-            table = render.diff_tree(diff_tree, names, render_data)
+        if args.output in ("jsonl", "arrow", "parquet"):
+            from minibudget import export
+            CommonParser.export(export.diff_columns(diff_tree, names, aggregates), args.output)
+        elif args.output == "text" and CommonParser.use_plain(args):
+            table = render.diff_plain(diff_tree, names, render_data, aggregates)
+            table.write(sys.stdout, width=render_data.width)
+        elif args.output == "text":
+            from rich.console import Console
+            table = render.diff_tree(diff_tree, names, render_data, aggregates)
             console = Console()
             console.print(table)
         elif args.output == "csv":
-            csv_rows = render.diff_csv(diff_tree, names, render_data)
+            csv_rows = render.diff_csv_rows(diff_tree, names, render_data, aggregates)
+            writer = csv.writer(sys.stdout)
+            writer.writerows(csv_rows)
+        elif args.output == "html":
+            sys.stdout.writelines(render.diff_html_stream(diff_tree, names, render_data, aggregates))
+            print()
+
+    @staticmethod
+    def diff_stream(args, render_data: render.RenderOptions, aggregates: Union[render.AggregateOptions, None]):
+        from minibudget import stream
+        if args.output not in ("csv", "html"):
+            raise ValueError("--stream only works with --output csv or --output html.")
+        if args.jobs != 1:
+            raise ValueError("--stream parses one file at a time, so it can't be used with --jobs.")
+
+        load = partial(cache.category_store, use_cache=args.use_cache, selector=CommonParser.get_selector(args))
+        names = [ Path(f).stem for f in args.files ]
+        csv_rows = render.stream_csv_rows(stream.diff_rows(args.files, load), names, render_data, aggregates)
+        if args.output == "csv":
             writer = csv.writer(sys.stdout)
             writer.writerows(csv_rows)
         elif args.output == "html":
-            page: str = render.diff_html(diff_tree, names, render_data)
-            print(page)
+            sys.stdout.writelines(render.csv_rows_html_stream(csv_rows))
+            print()
+
+    @staticmethod
+    def category_trees(
+            files: list[str],
+            jobs: int = 1,
+            use_cache: bool = True,
+            selector: Union[CategorySelector, None] = None
+    ) -> list[dict[str, Entry]]:
+        load = partial(file_to_category_dict, use_cache=use_cache, selector=selector)
+        if jobs == 1:
+            return [ load(filename) for filename in files ]
+        from concurrent.futures import ProcessPoolExecutor
+        # map() yields results in submission order, so periods stay in order
+        with ProcessPoolExecutor(max_workers=min(jobs, len(files))) as executor:
+            return list(executor.map(load, files))
+
+class ServeParser:
+    @staticmethod
+    def setup(parent_subparser):
+        serve_parser = parent_subparser.add_parser("serve", help="Serve reports, diffs and chart data over HTTP, keeping parsed budget files in memory.")
+        serve_parser.add_argument("--host", default="127.0.0.1", help="Address to listen on. Default is 127.0.0.1, so only this machine can connect.")
+        serve_parser.add_argument("--port", type=int, default=8080, help="Port to listen on. Default is 8080.")
+        serve_parser.add_argument("--root", default=".", help="Folder budget files are served from. Files outside of it can't be requested. Default is the current folder.")
+        CommonParser.setup_cache_options(serve_parser)
+        serve_parser.set_defaults(func=ServeParser.serve)
+
+    @staticmethod
+    def serve(args):
+        from minibudget import serve
+        if not Path(args.root).is_dir():
+            raise ValueError(f"{args.root} is not a folder.")
+        serve.serve(args.host, args.port, args.root, args.use_cache)
+
+class CompileParser:
+    @staticmethod
+    def setup(parent_subparser):
+        compile_parser = parent_subparser.add_parser("compile", help="Compile a .budget file to a .budgetc file, which loads faster. Other commands accept either.")
+        compile_parser.add_argument("file")
+        compile_parser.add_argument("--output", "-o", help="Where to write the compiled budget. Default is the same name with a .budgetc extension.")
+        compile_parser.set_defaults(func=CompileParser.compile)
+
+    @staticmethod
+    def compile(args):
+        from minibudget import compiled
+        if compiled.is_compiled(args.file):
+            raise ValueError(f"{args.file} is already compiled.")
+        output = args.output
+        if output is None:
+            output = str(Path(args.file).with_suffix(compiled.SUFFIX))
+        compiled.compile_file(args.file, output)
+        print(output)
 
 class ConvertParser:
     @staticmethod
@@ -153,19 +363,60 @@ class ConvertParser:
         convert_parser.add_argument("--width", help="Width of the output minibudget in characters. Default is 80.", default=80)
         convert_parser.add_argument("--start", help="Start date to query from, inclusive.")
         convert_parser.add_argument("--end", help="End date to query until, inclusive.")
-        convert_parser.add_argument("--currency", help="The currency to convert into minibudget format, where multiple are available. Default is USD.", default="USD")
-        convert_parser.add_argument("--format", help="Format of the input file to output as minibudget entries.", choices=["beancount"])
+        convert_parser.add_argument("--currency", help="The currency to convert into minibudget format, where multiple are available. With --batch this can be a comma separated list, e.g. USD,EUR. Default is USD.", default="USD")
+        convert_parser.add_argument("--format", help="Format of the input file to output as minibudget entries.", choices=["beancount", "budgetc"])
+        convert_parser.add_argument("--backend", help="How to query beancount files: in this process with the beanquery library, or by running bean-query. Default is to use the library if it's installed.", choices=["auto", "library", "bean-query"], default="auto")
+        convert_parser.add_argument("--batch", help="Write one budget per period between --start and --end and per currency, instead of printing one budget.", choices=["monthly", "quarterly", "yearly"])
+        convert_parser.add_argument("--output-dir", help="Folder to write budgets to with --batch. Default is the current folder.", default=".")
         convert_parser.set_defaults(func=ConvertParser.convert)
 
     @staticmethod
     def convert(args):
+        from minibudget import convert
         format = ConvertParser.infer_format(args)
+        if args.batch is not None:
+            ConvertParser.convert_batch(args, format)
+            return
+        if "," in args.currency:
+            raise ValueError("Multiple currencies can only be converted with --batch.")
         if format == "beancount":
-            entries = convert.beancount(args.file, args.currency, args.start, args.end)
+            entries = convert.beancount(args.file, args.currency, args.start, args.end, args.backend)
+        elif format == "budgetc":
+            from minibudget import compiled
+            entries = compiled.load(args.file)
         else:
             raise ValueError(f"{args.file} is not a parseable type.")
         print(convert.entry_list_to_string(entries, int(args.width)))
-        
+
+    @staticmethod
+    def convert_batch(args, format):
+        from concurrent.futures import ThreadPoolExecutor
+        from datetime import date
+        from minibudget import convert
+        if args.start is None or args.end is None:
+            raise ValueError("--batch needs both --start and --end.")
+        if format != "beancount":
+            raise ValueError(f"{args.file} is not a parseable type.")
+        currencies = [ c.strip() for c in args.currency.split(",") if len(c.strip()) > 0 ]
+        period_list = convert.periods(date.fromisoformat(args.start), date.fromisoformat(args.end), args.batch)
+        budgets = convert.beancount_batch(args.file, currencies, period_list, args.backend)
+
+        output_dir = Path(args.output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        width = int(args.width)
+
+        def write(item):
+            (label, currency), entries = item
+            path = output_dir / f"{label}-{currency}.budget"
+            text = convert.entry_list_to_string(entries, width)
+            # an empty period gets an empty file rather than a blank line
+            path.write_text(text + "\n" if len(entries) > 0 else "")
+            return path
+
+        with ThreadPoolExecutor() as executor:
+            for path in executor.map(write, budgets.items()):
+                print(path)
+
     @staticmethod
     def infer_format(args):
         if args.format is not None:
@@ -173,5 +424,7 @@ class ConvertParser:
         file_path = Path(args.file)
         if file_path.suffix == ".beancount":
             return "beancount"
+        if file_path.suffix == ".budgetc":
+            return "budgetc"
         return None
             
@@ -0,0 +1,85 @@
+from collections.abc import Iterator
+from typing import TextIO, Union
+
+# the gap between columns
+GAP = "  "
+
+class PlainTable:
+    """
+    A fixed-width text table, for output that isn't going to a terminal.
+
+    Column widths are kept up to date as rows are added, so writing the
+    table is a single pass which joins padded strings. Unlike a rich Table
+    nothing is measured, wrapped or styled.
+
+    A cell can have several lines, given as a list of strings. Sections are
+    separated by a rule, like rich's add_section.
+    """
+    def __init__(self, headers: Union[list[str], None], title: Union[str, None] = None, columns: int = 0):
+        self.title = title
+        self.headers = headers
+        if headers != None:
+            columns = len(headers)
+        self.widths = [ len(header) for header in headers ] if headers != None else [0] * columns
+        # each row is a list of cells, each cell a list of lines; None marks
+        # the start of a new section
+        self.rows: list[Union[list[list[str]], None]] = []
+
+    def add_row(self, *cells: Union[str, list[str]]):
+        row = [ [cell] if isinstance(cell, str) else cell for cell in cells ]
+        for i, cell in enumerate(row):
+            longest = max(map(len, cell), default=0)
+            if longest > self.widths[i]:
+                self.widths[i] = longest
+        self.rows.append(row)
+
+    def add_section(self):
+        if len(self.rows) > 0 and self.rows[-1] is not None:
+            self.rows.append(None)
+
+    def _line(self, cells: list[str], widths: list[int]) -> str:
+        parts = [ cells[0].ljust(widths[0]) ]
+        parts.extend(cell.rjust(width) for cell, width in zip(cells[1:], widths[1:]))
+        return GAP.join(parts)
+
+    def write(self, out: TextIO, widths: Union[list[int], None] = None, width: Union[int, None] = None):
+        """
+        Writes the table to `out`. `widths` overrides the column widths, e.g.
+        to line up several tables. If `width` is wider than the table, the
+        first column is padded to fill it.
+        """
+        widths = list(widths or self.widths)
+        total = sum(widths) + len(GAP) * (len(widths) - 1)
+        if width != None and width > total:
+            widths[0] += width - total
+            total = width
+        rule = "-" * total + "\n"
+
+        if self.title != None:
+            out.write(self.title.center(total).rstrip() + "\n")
+        if self.headers != None:
+            out.write(self._line(self.headers, widths) + "\n")
+            out.write("=" * total + "\n")
+
+        out.writelines(self._lines(widths, rule))
+
+    def _lines(self, widths: list[int], rule: str) -> Iterator[str]:
+        last = len(self.rows) - 1
+        for i, row in enumerate(self.rows):
+            if row is None:
+                if i != last:
+                    yield rule
+                continue
+            if all(len(cell) == 1 for cell in row):
+                yield self._line([ cell[0] for cell in row ], widths).rstrip() + "\n"
+                continue
+            for line in range(max(map(len, row))):
+                cells = [ cell[line] if line < len(cell) else "" for cell in row ]
+                yield self._line(cells, widths).rstrip() + "\n"
+
+def shared_widths(tables: list[PlainTable]) -> list[int]:
+    """
+    The widest of each column across tables with the same columns, so they
+    can be written lined up with each other.
+    """
+    return [ max(widths) for widths in zip(*(table.widths for table in tables)) ]
@@ -0,0 +1,276 @@
+from collections.abc import Callable
+from dataclasses import dataclass, asdict
+import functools
+import importlib
+import inspect
+import json
+import sys
+import time
+import tracemalloc
+from typing import Union
+
+# Pipeline stages which are timed with --profile, as (module, attribute).
+# Call sites look these up through their module or class at call time, so
+# replacing the attribute is enough to see every call.
+STAGES = [
+    ("minibudget.parsers", "DiffParser.category_trees"),
+    ("minibudget.cache", "budget"),
+    ("minibudget.cache", "report_data"),
+    ("minibudget.cache", "rollups"),
+    ("minibudget.cache", "category_dict"),
+    ("minibudget.parse", "budget"),
+    ("minibudget.shard", "rollup"),
+    ("minibudget.shard", "Rollup.report_data"),
+    ("minibudget.compiled", "load"),
+    ("minibudget.compiled", "load_latest"),
+    ("minibudget.transform", "entries_to_report_data"),
+    ("minibudget.transform", "generate_category_dict"),
+    ("minibudget.transform", "generate_diff_dict"),
+    ("minibudget.transform", "generate_triple_list"),
+    ("minibudget.transform", "generate_sunburst_lists"),
+    ("minibudget.stream", "diff_rows"),
+    ("minibudget.matrix", "DiffMatrix.from_diff_dict"),
+    ("minibudget.render", "diff_text_columns"),
+    ("minibudget.render", "report"),
+    ("minibudget.render", "report_table"),
+    ("minibudget.render", "report_plain"),
+    ("minibudget.render", "diff_plain"),
+    ("minibudget.plain", "PlainTable.write"),
+    ("minibudget.export", "report_columns"),
+    ("minibudget.export", "diff_columns"),
+    ("minibudget.export", "write"),
+    ("minibudget.render", "diff_tree"),
+    ("minibudget.render", "diff_csv_rows"),
+    ("minibudget.render", "diff_html_stream"),
+    ("minibudget.render", "stream_csv_rows"),
+    ("rich.console", "Console.print")
+]
+
+def peak_rss() -> int:
+    """
+    The most memory this process has had resident so far, in bytes, or 0
+    where that isn't available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes everywhere except macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+@dataclass
+class StageStats:
+    name: str
+    calls: int = 0
+    seconds: float = 0.0
+    # only with memory tracing: the most memory allocated by Python during
+    # the stage above what was allocated when it started
+    peak_bytes: int = 0
+
+class _Frame:
+    __slots__ = ("stats", "start", "start_bytes", "peak")
+
+    def __init__(self, stats: Union[StageStats, None], start_bytes: int):
+        self.stats = stats
+        self.start = time.perf_counter()
+        self.start_bytes = start_bytes
+        self.peak = start_bytes
+
+class Profiler:
+    """
+    Records wall time, call counts and peak memory for each pipeline stage.
+
+    Stage times include the stages they call, e.g. cache.report_data includes
+    parse.budget. Generators are timed while they're being consumed, so
+    streamed output counts towards the stage that produces it.
+
+    By default only the whole process's peak resident memory is recorded,
+    which costs nothing to measure but can't be split between stages.
+    trace_memory uses tracemalloc to find how much each stage allocates, but
+    makes everything several times slower.
+    """
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.stages: dict[str, StageStats] = {}
+        self.stack: list[_Frame] = []
+        self.patched: list[tuple[object, str, object]] = []
+        self.seconds = 0.0
+        self.peak_bytes = 0
+
+    def _enter(self, stats: Union[StageStats, None]):
+        if not self.trace_memory:
+            self.stack.append(_Frame(stats, 0))
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        # reset_peak() is shared by every frame, so pass the peak seen so
+        # far to the enclosing frame before starting a new one
+        if len(self.stack) > 0:
+            parent = self.stack[-1]
+            parent.peak = max(parent.peak, peak)
+        tracemalloc.reset_peak()
+        self.stack.append(_Frame(stats, current))
+
+    def _exit(self):
+        frame = self.stack.pop()
+        seconds = time.perf_counter() - frame.start
+        if not self.trace_memory:
+            if frame.stats != None:
+                frame.stats.seconds += seconds
+            return seconds, peak_rss()
+        _, peak = tracemalloc.get_traced_memory()
+        peak = max(frame.peak, peak)
+        if len(self.stack) > 0:
+            parent = self.stack[-1]
+            parent.peak = max(parent.peak, peak)
+        tracemalloc.reset_peak()
+        if frame.stats != None:
+            frame.stats.seconds += seconds
+            frame.stats.peak_bytes = max(frame.stats.peak_bytes, peak - frame.start_bytes)
+        return seconds, peak - frame.start_bytes
+
+    def _active(self, stats: StageStats) -> bool:
+        return any(frame.stats is stats for frame in self.stack)
+
+    def _stream(self, stats: StageStats, generator):
+        while True:
+            # a stage already on the stack is being timed by its outer call
+            active = self._active(stats)
+            self._enter(None if active else stats)
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                self._exit()
+            yield item
+
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        stats = self.stages.setdefault(name, StageStats(name))
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            stats.calls += 1
+            active = self._active(stats)
+            self._enter(None if active else stats)
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                self._exit()
+            if inspect.isgenerator(result):
+                return self._stream(stats, result)
+            return result
+        return timed
+
+    def install(self, stages: list[tuple[str, str]] = STAGES):
+        for module_name, path in stages:
+            try:
+                owner = importlib.import_module(module_name)
+            except ImportError:
+                continue
+            *owners, attribute = path.split(".")
+            for name in owners:
+                owner = getattr(owner, name)
+            original = inspect.getattr_static(owner, attribute)
+            name = f"{module_name.removeprefix('minibudget.')}.{path}"
+            if isinstance(original, staticmethod):
+                replacement = staticmethod(self.wrap(name, original.__func__))
+            elif isinstance(original, classmethod):
+                replacement = classmethod(self.wrap(name, original.__func__))
+            else:
+                replacement = self.wrap(name, original)
+            self.patched.append((owner, attribute, original))
+            setattr(owner, attribute, replacement)
+
+    def uninstall(self):
+        for owner, attribute, original in reversed(self.patched):
+            setattr(owner, attribute, original)
+        self.patched = []
+
+    def run(self, fn: Callable, *args, **kwargs):
+        """
+        Runs fn with every stage instrumented.
+        """
+        self.install()
+        if self.trace_memory:
+            tracemalloc.start()
+        self._enter(None)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.seconds, self.peak_bytes = self._exit()
+            if self.trace_memory:
+                tracemalloc.stop()
+            self.uninstall()
+
+    def to_dict(self) -> dict:
+        return {
+            "memory": "traced" if self.trace_memory else "peak_rss",
+            "seconds": self.seconds,
+            "peak_bytes": self.peak_bytes,
+            "stages": [
+                { key: value for key, value in asdict(stats).items() if self.trace_memory or key != "peak_bytes" }
+                for stats in self.stages.values() if stats.calls > 0
+            ]
+        }
+
+    def summary(self) -> str:
+        def megabytes(n: int) -> str:
+            return f"{n / (1024 * 1024):.1f} MB"
+
+        header = ("Stage", "Calls", "Time (s)")
+        rows = [ (s.name, str(s.calls), f"{s.seconds:.3f}") for s in self.stages.values() if s.calls > 0 ]
+        rows.append(("total", "", f"{self.seconds:.3f}"))
+        if self.trace_memory:
+            header += ("Peak memory",)
+            peaks = [ s.peak_bytes for s in self.stages.values() if s.calls > 0 ] + [ self.peak_bytes ]
+            rows = [ row + (megabytes(peak),) for row, peak in zip(rows, peaks) ]
+        width = max(len(row[0]) for row in rows + [header])
+
+        def line(row: tuple) -> str:
+            cells = [ f"{row[0]:<{width}}", f"{row[1]:>6}", f"{row[2]:>10}" ]
+            cells.extend(f"{cell:>12}" for cell in row[3:])
+            return "  ".join(cells)
+
+        lines = [ line(header) ] + [ line(row) for row in rows ]
+        if not self.trace_memory:
+            # resident memory only has a high-water mark for the whole
+            # process, so it can't be given for each stage
+            lines.append(f"Peak RSS of the whole process: {megabytes(self.peak_bytes)}")
+        return "\n".join(lines)
+
+def run(
+        fn: Callable,
+        args,
+        profile: bool = False,
+        profile_output: Union[str, None] = None,
+        cprofile_output: Union[str, None] = None,
+        trace_memory: bool = False
+):
+    """
+    Runs fn(args), optionally under the stage profiler and/or cProfile.
+    Stage results go to profile_output as JSON, or to stderr as a table.
+    cProfile stats are written to cprofile_output for use with pstats.
+    """
+    call = lambda: fn(args)
+    if cprofile_output != None:
+        import cProfile
+        cprofiler = cProfile.Profile()
+        inner = call
+        call = lambda: cprofiler.runcall(inner)
+
+    profiler = Profiler(trace_memory) if profile else None
+    try:
+        if profiler != None:
+            profiler.run(call)
+        else:
+            call()
+    finally:
+        if cprofile_output != None:
+            cprofiler.dump_stats(cprofile_output)
+        if profiler != None:
+            if profile_output != None:
+                with open(profile_output, "w") as f:
+                    json.dump(profiler.to_dict(), f, indent=2)
+            else:
+                print(profiler.summary(), file=sys.stderr)
@@ -1,12 +1,19 @@
-import rich
-from rich.markup import render
 from minibudget.model import ReportData, Entry
 from dataclasses import dataclass
-from minibudget.helpers import dft_diff_dict, dft_entry_dict
-from rich.table import Table
-from rich.text import Text
-from typing import Union
-from jinja2 import Environment, PackageLoader, select_autoescape
+from minibudget.helpers import iter_entry_dict
+from minibudget.matrix import DiffMatrix, year_starts
+from minibudget.plain import PlainTable, shared_widths
+from typing import TYPE_CHECKING, TextIO, Union
+from collections.abc import Iterable, Iterator
+from functools import lru_cache
+from itertools import accumulate
+from operator import sub
+from string import Formatter
+
+# rich and jinja2 are imported by the functions that need them so that
+# importing this module stays cheap for outputs which use neither.
+if TYPE_CHECKING:
+    from rich.table import Table
 
 @dataclass
 class RenderOptions:
@@ -14,33 +21,174 @@ class RenderOptions:
     currency_format: str
     currency_decimals: int
 
+@dataclass
+class AggregateOptions:
+    # window sizes, in periods
+    rolling: list[int]
+    averages: list[int]
+    year_to_date: bool
+
 PREDEFINED_CURRENCIES = {
     "NTD": RenderOptions(width=0, currency_format="{neg}{amount} NTD", currency_decimals=0),
     "USD": RenderOptions(width=0, currency_format="{neg}${amount}", currency_decimals=2)
 }
 
-def report_table(title: str,categories: dict[str, Entry], total: int, render_data: RenderOptions) -> Table: 
+class CurrencyFormatter:
+    """
+    Formats units the same way as currency(), but works out the format
+    string once and remembers recently formatted amounts.
+    """
+    def __init__(self, render_data: RenderOptions, cache_size: int = 4096):
+        self.currency_format = render_data.currency_format
+        self.currency_decimals = render_data.currency_decimals
+        self._affixes = CurrencyFormatter._compile(render_data.currency_format)
+        self.format = lru_cache(maxsize=cache_size)(self._format)
+
+    @classmethod
+    def predefined(cls, name: str, cache_size: int = 4096) -> "CurrencyFormatter":
+        return cls(PREDEFINED_CURRENCIES[name], cache_size)
+
+    @staticmethod
+    def _compile(currency_format: str) -> Union[dict[bool, tuple[str, str]], None]:
+        """
+        For formats which only use plain {neg} and {amount} fields, returns
+        the text before and after the amount for positive and negative
+        numbers. Anything fancier is left to str.format.
+        """
+        amount_fields = 0
+        for _, field, spec, conversion in Formatter().parse(currency_format):
+            if field is None:
+                continue
+            if field not in ("neg", "amount") or spec or conversion is not None:
+                return None
+            if field == "amount":
+                amount_fields += 1
+        if amount_fields != 1:
+            return None
+        marker = "\0"
+        affixes = {}
+        for is_negative in (False, True):
+            parts = currency_format.format(amount=marker, neg="-" if is_negative else "").split(marker)
+            if len(parts) != 2:
+                return None
+            affixes[is_negative] = (parts[0], parts[1])
+        return affixes
+
+    def _format(self, units: int) -> str:
+        amount = str(abs(units))
+        decimal = self.currency_decimals
+        if decimal > 0:
+            left = amount[:-decimal] or "0"
+            right = amount[-decimal:].ljust(decimal, "0")
+            amount = left + "." + right
+        if self._affixes is None:
+            return self.currency_format.format(amount=amount, neg="-" if units < 0 else "")
+        before, after = self._affixes[units < 0]
+        return before + amount + after
+
+    def format_many(self, units: Iterable[int]) -> list[str]:
+        """
+        Formats many amounts at once, e.g. a whole column of a table.
+        """
+        return list(map(self.format, units))
+
+def report_table(
+        title: str,
+        categories: dict[str, Entry],
+        total: int,
+        render_data: RenderOptions,
+        formatter: Union[CurrencyFormatter, None] = None
+) -> "Table":
+    from rich.table import Table
+    if formatter is None:
+        formatter = CurrencyFormatter(render_data)
     table = Table(title=title, expand=True)
     if render_data.width != None:
         table.width = render_data.width
         table.expand = False
     table.add_column("Category", ratio=5)
     table.add_column("Amount", justify="right", ratio=2)
+    fill_report_table(table, categories, total, formatter)
+    return table
 
-    def render_category(entry: Entry):
+def report_table_plain(
+        title: str,
+        categories: dict[str, Entry],
+        total: int,
+        formatter: CurrencyFormatter
+) -> PlainTable:
+    table = PlainTable(["Category", "Amount"], title=title)
+    fill_report_table(table, categories, total, formatter)
+    return table
+
+def fill_report_table(
+        table: Union["Table", PlainTable],
+        categories: dict[str, Entry],
+        total: int,
+        formatter: CurrencyFormatter
+):
+    for entry in iter_entry_dict(categories):
         depth = len(entry.categories) - 1
         tag = entry.categories[-1]
         left = f"{' ' * 4 * depth}{tag}"
-        right = currency(entry.amount, render_data)
+        right = formatter.format(entry.amount)
         table.add_row(left, right)
-    
-    dft_entry_dict(categories, fn=render_category)
+
     table.add_section()
-    table.add_row("Total", currency(total, render_data))
+    table.add_row("Total", formatter.format(total))
 
-    return table
+def aggregate_columns(
+        matrix: DiffMatrix,
+        names: list[str],
+        aggregates: Union[AggregateOptions, None]
+) -> list[tuple[str, list]]:
+    """
+    Returns (label, one column per period) for each aggregate asked for.
+    """
+    if aggregates is None:
+        return []
+    output = []
+    for window in aggregates.rolling:
+        output.append((f"sum{window}", matrix.rolling_totals(window)))
+    for window in aggregates.averages:
+        output.append((f"avg{window}", matrix.rolling_averages(window)))
+    if aggregates.year_to_date:
+        output.append(("ytd", matrix.year_to_date(year_starts(names))))
+    return output
+
+def aggregate_labels(aggregates: Union[AggregateOptions, None]) -> list[str]:
+    if aggregates is None:
+        return []
+    return ([ f"sum{window}" for window in aggregates.rolling ]
+            + [ f"avg{window}" for window in aggregates.averages ]
+            + (["ytd"] if aggregates.year_to_date else []))
 
-def diff_tree(tree: dict[str, list[Union[Entry, None]]], names: list[str], render_data: RenderOptions) -> Table:
+def aggregate_row(amounts: list[int], starts: list[int], aggregates: Union[AggregateOptions, None]) -> list[list[int]]:
+    """
+    The same values as aggregate_columns for a single row, where `starts`
+    is year_starts() of the period names.
+    """
+    if aggregates is None:
+        return []
+    prefix = [0, *accumulate(amounts)]
+    periods = range(len(amounts))
+    output = []
+    for window in aggregates.rolling:
+        output.append([ prefix[i + 1] - prefix[max(0, i + 1 - window)] for i in periods ])
+    for window in aggregates.averages:
+        output.append([ round((prefix[i + 1] - prefix[max(0, i + 1 - window)]) / min(i + 1, window)) for i in periods ])
+    if aggregates.year_to_date:
+        output.append([ prefix[i + 1] - prefix[starts[i]] for i in periods ])
+    return output
+
+def diff_tree(
+        tree: dict[str, list[Union[Entry, None]]],
+        names: list[str],
+        render_data: RenderOptions,
+        aggregates: Union[AggregateOptions, None] = None
+) -> "Table":
+    from rich.table import Table
+    from rich.text import Text
     table = Table(expand=True)
     if render_data.width != None:
         table.width = render_data.width
@@ -49,28 +197,14 @@ def diff_tree(tree: dict[str, list[Union[Entry, None]]], names: list[str], rende
     for name in names:
         table.add_column(name, justify="right")
  
-    def render_category(entries: list[Union[Entry, None]]):
-        amounts = []
-        for entry in entries:
-            if entry == None:
-                amounts.append(0)
-            else:
-                amounts.append(entry.amount)
-        tag = ""
-        depth = 0 
-
-        for entry in entries:
-            if entry != None:
-                tag = entry.categories[-1]
-                depth = len(entry.categories) - 1
-
-        category = f"{'    '*depth}{tag}"
-        cells = [Text( currency(amounts[0], render_data) )]
-
-        for i, amount in enumerate(amounts[1:]):
-            diff = amount - amounts[i]
-            amount_rendered = f"{currency(amount, render_data)}\n"
-            diff_rendered = Text(currency(diff, render_data))
+    matrix, amount_columns, diff_columns, aggregate_lines = diff_text_columns(tree, names, render_data, aggregates)
+    for row, (key, depth, amounts, diffs) in enumerate(matrix.rows()):
+        category = f"{'    '*depth}{key[key.rfind(':') + 1:]}"
+        cells = [Text( amount_columns[0][row] )]
+
+        for i, diff in enumerate(diffs):
+            amount_rendered = f"{amount_columns[i + 1][row]}\n"
+            diff_rendered = Text(diff_columns[i][row])
             if diff > 0:
                 diff_rendered.stylize("green")
             elif diff == 0:
@@ -78,68 +212,163 @@ def diff_tree(tree: dict[str, list[Union[Entry, None]]], names: list[str], rende
             elif diff < 0:
                 diff_rendered.stylize("red")
             cells.append( Text.assemble(amount_rendered,diff_rendered) )
+
+        if len(aggregate_lines) > 0 and len(cells) > 1:
+            # the first period has no diff line; keep aggregates level
+            cells[0].append("\n")
+        for label, columns in aggregate_lines:
+            for cell, column in zip(cells, columns):
+                cell.append(f"\n{label} {column[row]}", style="blue")
         
         if depth == 0:
             table.add_section()
         table.add_row( category, *cells )
         if depth == 0:
             table.add_section()
-        
-    dft_diff_dict(tree, fn=render_category)
+
     return table
 
 
-def diff_csv(
+def diff_text_columns(
+        tree: dict[str, list[Union[Entry, None]]],
+        names: list[str],
+        render_data: RenderOptions,
+        aggregates: Union[AggregateOptions, None] = None
+) -> tuple[DiffMatrix, list[list[str]], list[list[str]], list[tuple[str, list[list[str]]]]]:
+    """
+    The matrix for a diff, with its amounts, diffs and aggregates formatted
+    a whole column at a time.
+    """
+    matrix = DiffMatrix.from_diff_dict(tree)
+    formatter = CurrencyFormatter(render_data)
+    amount_columns = [ formatter.format_many(column) for column in matrix.columns ]
+    diff_columns = [ formatter.format_many(column) for column in matrix.diffs ]
+    aggregate_lines = [
+        (label, [ formatter.format_many(column) for column in columns ])
+        for label, columns in aggregate_columns(matrix, names, aggregates)
+    ]
+    return matrix, amount_columns, diff_columns, aggregate_lines
+
+def diff_plain(
         tree: dict[str, list[Union[Entry, None]]],
         names: list[str],
-        render_data: RenderOptions
-) -> list[list[str]]: 
-    rows = []
+        render_data: RenderOptions,
+        aggregates: Union[AggregateOptions, None] = None
+) -> PlainTable:
+    """
+    The same rows and sections as diff_tree, as a PlainTable.
+    """
+    table = PlainTable(["Category", *names])
+    matrix, amount_columns, diff_columns, aggregate_lines = diff_text_columns(tree, names, render_data, aggregates)
+    # the first period has no diff line; keep aggregates level
+    first = [""] if len(aggregate_lines) > 0 and len(names) > 1 else []
+    for row, (key, depth, _, _) in enumerate(matrix.rows()):
+        category = f"{'    '*depth}{key[key.rfind(':') + 1:]}"
+        cells = [ [amount_columns[0][row], *first] ]
+        for i, column in enumerate(diff_columns):
+            cells.append([ amount_columns[i + 1][row], column[row] ])
+        for label, columns in aggregate_lines:
+            for cell, column in zip(cells, columns):
+                cell.append(f"{label} {column[row]}")
+
+        if depth == 0:
+            table.add_section()
+        table.add_row(category, *cells)
+        if depth == 0:
+            table.add_section()
+
+    return table
+
+def diff_csv_rows(
+        tree: dict[str, list[Union[Entry, None]]],
+        names: list[str],
+        render_data: RenderOptions,
+        aggregates: Union[AggregateOptions, None] = None
+) -> Iterator[list[str]]:
+    matrix = DiffMatrix.from_diff_dict(tree)
+    aggregate_list = aggregate_columns(matrix, names, aggregates)
+    yield diff_csv_header(names, [ label for label, _ in aggregate_list ])
+
+    # formatted row by row so rows can be streamed out as they're made
+    formatter = CurrencyFormatter(render_data)
+    for row_index, (key, _, amounts, diffs) in enumerate(matrix.rows()):
+        row = [key]
+        # add raw amounts
+        row.extend(formatter.format_many(amounts))
+        # add diff columns
+        row.extend(formatter.format_many(diffs))
+        for _, columns in aggregate_list:
+            row.extend(formatter.format_many(column[row_index] for column in columns))
+
+        yield row
+
+def diff_csv_header(names: list[str], aggregate_labels: list[str]) -> list[str]:
     header = ["Category"] + names
 
     # add diff column headers
     for i, name in enumerate(names[1:]):
         header.append(f"diff({names[i]},{name})")
 
-    rows.append(header)
- 
-    def render_category(entries: list[Union[Entry, None]]):
-        amounts = []
-        for entry in entries:
-            if entry == None:
-                amounts.append(0)
-            else:
-                amounts.append(entry.amount)
-
-        tag = ""
-        for entry in entries:
-            if entry != None:
-                tag = ":".join(entry.categories)
-        
-        row = [tag]
-        # add raw amounts
-        for amount in amounts:
-            row.append(currency(amount, render_data)) 
-        # add diff columns
-        for i, amount in enumerate(amounts[1:]):
-            diff = amount - amounts[i]
-            row.append(currency(diff, render_data))
- 
-        rows.append(row)
+    for label in aggregate_labels:
+        header.extend(f"{label}({name})" for name in names)
+    return header
 
-    dft_diff_dict(tree, fn=render_category)
+def stream_csv_rows(
+        rows: Iterable[tuple[str, int, list[int]]],
+        names: list[str],
+        render_data: RenderOptions,
+        aggregates: Union[AggregateOptions, None] = None
+) -> Iterator[list[str]]:
+    """
+    Like diff_csv_rows, for (key, depth, amounts) rows such as those from
+    stream.diff_rows. Each row is formatted as it arrives.
+    """
+    yield diff_csv_header(names, aggregate_labels(aggregates))
 
-    return rows
+    formatter = CurrencyFormatter(render_data)
+    starts = year_starts(names)
+    for key, _, amounts in rows:
+        row = [key]
+        row.extend(formatter.format_many(amounts))
+        row.extend(formatter.format_many(map(sub, amounts[1:], amounts)))
+        for values in aggregate_row(amounts, starts, aggregates):
+            row.extend(formatter.format_many(values))
+        yield row
 
-def diff_html(
+def diff_csv(
+        tree: dict[str, list[Union[Entry, None]]],
+        names: list[str],
+        render_data: RenderOptions,
+        aggregates: Union[AggregateOptions, None] = None
+) -> list[list[str]]:
+    return list(diff_csv_rows(tree, names, render_data, aggregates))
+
+def diff_html_stream(
         tree: dict[str, list[Union[Entry, None]]],
         names: list[str],
-        render_data: RenderOptions
-) -> str: 
-    table = diff_csv(tree, names, render_data)
+        render_data: RenderOptions,
+        aggregates: Union[AggregateOptions, None] = None
+) -> Iterator[str]:
+    return csv_rows_html_stream(diff_csv_rows(tree, names, render_data, aggregates))
+
+def csv_rows_html_stream(rows: Iterator[list[str]]) -> Iterator[str]:
+    """
+    Renders a header row followed by the other rows as an HTML table,
+    streaming both.
+    """
+    from jinja2 import Environment, PackageLoader, select_autoescape
+    header = next(rows)
     env = Environment(loader=PackageLoader("minibudget"), autoescape=select_autoescape())
     template = env.get_template("diff.html")
-    return template.render(table=table)
+    return template.generate(header=header, rows=rows)
+
+def diff_html(
+        tree: dict[str, list[Union[Entry, None]]],
+        names: list[str],
+        render_data: RenderOptions,
+        aggregates: Union[AggregateOptions, None] = None
+) -> str:
+    return "".join(diff_html_stream(tree, names, render_data, aggregates))
 
 def currency(units: int, render_data: RenderOptions) -> str:
     # so we can do e.g. -$100 instead of $-100
@@ -157,20 +386,23 @@ def currency(units: int, render_data: RenderOptions) -> str:
     return output
 
 def report(data: ReportData, render_data: RenderOptions):
-    console = rich.console.Console()
+    from rich.console import Console
+    from rich.table import Table
+    console = Console()
+    formatter = CurrencyFormatter(render_data)
     
-    income_table = report_table("Income",data.income_dict, data.total_income, render_data)
-    expense_table = report_table("Expenses",data.expense_dict, data.total_expenses, render_data)
+    income_table = report_table("Income",data.income_dict, data.total_income, render_data, formatter)
+    expense_table = report_table("Expenses",data.expense_dict, data.total_expenses, render_data, formatter)
 
     unassigned_style = "default"
     unassigned_string = "All funds have been assigned. =)"
 
     if data.total_unassigned < 0:
         unassigned_style = "red"
-        unassigned_string = currency(data.total_unassigned, render_data)
+        unassigned_string = formatter.format(data.total_unassigned)
     elif data.total_unassigned > 0:
         unassigned_style = "green"
-        unassigned_string = currency(data.total_unassigned, render_data)
+        unassigned_string = formatter.format(data.total_unassigned)
 
     unassigned_table = Table(expand=True, show_header=False, border_style=unassigned_style, row_styles=[unassigned_style])
     
@@ -185,5 +417,27 @@ def report(data: ReportData, render_data: RenderOptions):
  
     console.print(income_table, expense_table, unassigned_table)
  
+def report_plain(data: ReportData, render_data: RenderOptions, out: TextIO):
+    """
+    Writes the same report as report() as plain fixed-width text, for
+    output which isn't a terminal.
+    """
+    formatter = CurrencyFormatter(render_data)
+    income_table = report_table_plain("Income", data.income_dict, data.total_income, formatter)
+    expense_table = report_table_plain("Expenses", data.expense_dict, data.total_expenses, formatter)
+
+    unassigned_string = "All funds have been assigned. =)"
+    if data.total_unassigned != 0:
+        unassigned_string = formatter.format(data.total_unassigned)
+    unassigned_table = PlainTable(None, columns=2)
+    unassigned_table.add_row("Unassigned funds", unassigned_string)
+
+    tables = [income_table, expense_table, unassigned_table]
+    widths = shared_widths(tables)
+    for i, table in enumerate(tables):
+        if i > 0:
+            out.write("\n")
+        table.write(out, widths, render_data.width)
+
 def diff(reports: list[ReportData], render_data: RenderOptions):
     pass
@@ -0,0 +1,82 @@
+from fnmatch import translate
+import re
+from typing import Union
+
+GLOB_CHARACTERS = "*?["
+
+class CategorySelector:
+    """
+    Decides which categories to keep for --only and --exclude.
+
+    Patterns are globs on category paths such as "Essential" or
+    "*:Insurance". A pattern matches a category if it matches the category's
+    path or the path of any of its ancestors, so "Essential" selects
+    everything under Essential too.
+
+    Every path and prefix seen is remembered in an index, so each distinct
+    category is only compared with the patterns once, and its descendants
+    reuse the result.
+    """
+    def __init__(self, only: Union[list[str], None] = None, exclude: Union[list[str], None] = None):
+        self.only = list(only or [])
+        self.exclude = list(exclude or [])
+        self.index: dict[str, bool] = {}
+        self._only_index: dict[str, bool] = {}
+        self._exclude_index: dict[str, bool] = {}
+        self._only_pattern = CategorySelector._compile(self.only)
+        self._exclude_pattern = CategorySelector._compile(self.exclude)
+        self.search = CategorySelector._compile_search(self.only)
+
+    @staticmethod
+    def _compile(patterns: list[str]) -> Union[re.Pattern, None]:
+        if len(patterns) == 0:
+            return None
+        return re.compile("|".join(translate(pattern) for pattern in patterns))
+
+    @staticmethod
+    def _compile_search(patterns: list[str]) -> Union[re.Pattern, None]:
+        """
+        Every selected path starts with the text before the first wildcard
+        of one of the --only patterns. Returns a regex which finds those
+        prefixes, or None if any pattern starts with a wildcard.
+        """
+        prefixes = []
+        for pattern in patterns:
+            cut = len(pattern)
+            for char in GLOB_CHARACTERS:
+                found = pattern.find(char)
+                if found != -1:
+                    cut = min(cut, found)
+            if cut == 0:
+                return None
+            prefixes.append(re.escape(pattern[:cut]))
+        if len(prefixes) == 0:
+            return None
+        return re.compile("|".join(prefixes))
+
+    @staticmethod
+    def _matches(pattern: re.Pattern, index: dict[str, bool], path: str) -> bool:
+        # walk up to the nearest prefix which is already decided, then decide
+        # each prefix below it on the way back down
+        cuts = []
+        cut = len(path)
+        while cut != -1 and path[:cut] not in index:
+            cuts.append(cut)
+            cut = path.rfind(":", 0, cut)
+        found = index[path[:cut]] if cut != -1 else False
+        for cut in reversed(cuts):
+            prefix = path[:cut]
+            found = found or pattern.match(prefix) != None
+            index[prefix] = found
+        return found
+
+    def __call__(self, path: str) -> bool:
+        selected = self.index.get(path)
+        if selected is None:
+            selected = True
+            if self._only_pattern != None:
+                selected = CategorySelector._matches(self._only_pattern, self._only_index, path)
+            if selected and self._exclude_pattern != None:
+                selected = not CategorySelector._matches(self._exclude_pattern, self._exclude_index, path)
+            self.index[path] = selected
+        return selected
@@ -0,0 +1,291 @@
+import asyncio
+from dataclasses import dataclass
+import json
+import os
+from pathlib import Path
+import sys
+from typing import Union
+from urllib.parse import parse_qs, unquote, urlsplit
+from minibudget import cache
+from minibudget import render
+from minibudget import transform
+from minibudget.helpers import entry_dict_index, walk
+from minibudget.matrix import DiffMatrix
+from minibudget.model import Entry, ReportData
+from minibudget.render import CurrencyFormatter, RenderOptions
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error"
+}
+
+# more digits than any int64 amount has
+MAX_CURRENCY_DECIMALS = 18
+
+@dataclass
+class BudgetState:
+    """
+    Everything the server needs from one version of a budget file.
+    """
+    signature: tuple[int, int]
+    report_data: ReportData
+    # all entries rolled up together, as used by diff
+    category_dict: dict[str, Entry]
+
+def _signature(path: Path) -> tuple[int, int]:
+    stat = path.stat()
+    return (stat.st_mtime_ns, stat.st_size)
+
+def load_state(path: Path, use_cache: bool = True) -> BudgetState:
+    # stat before reading so that a write during the parse shows up as a
+    # change on the next request rather than being missed
+    signature = _signature(path)
+    report_data, category_dict = cache.rollups(str(path), use_cache)
+    return BudgetState(signature, report_data, category_dict)
+
+class BudgetStore:
+    """
+    Parsed budget files kept in memory and reloaded when their modification
+    time or size changes.
+
+    Requests for a file which is already loading wait for that load instead
+    of starting another, so concurrent requests parse each version once.
+    """
+    def __init__(self, root: Path, use_cache: bool = True):
+        self.root = root.resolve()
+        self.use_cache = use_cache
+        self.states: dict[Path, BudgetState] = {}
+        self.loading: dict[Path, asyncio.Future] = {}
+
+    def resolve(self, filename: str) -> Path:
+        path = (self.root / filename).resolve()
+        if not path.is_relative_to(self.root):
+            raise HTTPError(403, f"{filename} is outside of {self.root}.")
+        if not path.is_file():
+            raise HTTPError(404, f"{filename} does not exist.")
+        return path
+
+    async def get(self, filename: str) -> BudgetState:
+        path = self.resolve(filename)
+        state = self.states.get(path)
+        if state != None and state.signature == _signature(path):
+            return state
+
+        pending = self.loading.get(path)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = loop.run_in_executor(None, load_state, path, self.use_cache)
+            self.loading[path] = pending
+            try:
+                self.states[path] = await pending
+            finally:
+                del self.loading[path]
+        return await pending
+
+def render_options(query: dict[str, list[str]]) -> RenderOptions:
+    currency = query.get("currency", [None])[0]
+    if currency != None:
+        if currency not in render.PREDEFINED_CURRENCIES:
+            raise HTTPError(400, f"{currency} is not a predefined currency.")
+        predefined = render.PREDEFINED_CURRENCIES[currency]
+        return RenderOptions(None, predefined.currency_format, predefined.currency_decimals)
+    currency_format = query.get("currency_format", ["{neg}${amount}"])[0]
+    try:
+        affixes = CurrencyFormatter._compile(currency_format)
+    except ValueError:
+        affixes = None
+    if affixes is None:
+        # anything else goes to str.format, which can read attributes or be
+        # asked for enormous padding
+        raise HTTPError(400, "currency_format must have one {amount} and may have {neg}, without format specs or conversions.")
+    try:
+        currency_decimals = int(query.get("currency_decimals", ["2"])[0])
+    except ValueError:
+        raise HTTPError(400, "currency_decimals must be a number.")
+    if currency_decimals < 0 or currency_decimals > MAX_CURRENCY_DECIMALS:
+        raise HTTPError(400, f"currency_decimals must be from 0 to {MAX_CURRENCY_DECIMALS}.")
+    return RenderOptions(None, currency_format, currency_decimals)
+
+def category_rows(category_dict: dict[str, Entry], formatter: CurrencyFormatter) -> list[dict]:
+    rows = []
+    for key, depth in walk(entry_dict_index(category_dict)):
+        entry = category_dict[key]
+        rows.append({
+            "category": key,
+            "name": entry.categories[-1],
+            "depth": depth,
+            "amount": entry.amount,
+            "formatted": formatter.format(entry.amount),
+            "is_calculated": entry.is_calculated
+        })
+    return rows
+
+def report_json(state: BudgetState, render_data: RenderOptions) -> dict:
+    data = state.report_data
+    formatter = CurrencyFormatter(render_data)
+    return {
+        "total_income": data.total_income,
+        "total_expenses": data.total_expenses,
+        "total_unassigned": data.total_unassigned,
+        "income": category_rows(data.income_dict, formatter),
+        "expenses": category_rows(data.expense_dict, formatter)
+    }
+
+def report_html(state: BudgetState, render_data: RenderOptions) -> str:
+    from jinja2 import Environment, PackageLoader, select_autoescape
+    env = Environment(loader=PackageLoader("minibudget"), autoescape=select_autoescape())
+    template = env.get_template("report.html")
+    data = state.report_data
+    formatter = CurrencyFormatter(render_data)
+    return template.render(
+        income=category_rows(data.income_dict, formatter),
+        expenses=category_rows(data.expense_dict, formatter),
+        total_income=formatter.format(data.total_income),
+        total_expenses=formatter.format(data.total_expenses),
+        total_unassigned=data.total_unassigned,
+        unassigned=formatter.format(data.total_unassigned)
+    )
+
+def diff_json(states: list[BudgetState], names: list[str], render_data: RenderOptions) -> dict:
+    diff_dict = transform.generate_diff_dict([ state.category_dict for state in states ])
+    matrix = DiffMatrix.from_diff_dict(diff_dict)
+    formatter = CurrencyFormatter(render_data)
+    rows = []
+    for key, depth, amounts, diffs in matrix.rows():
+        rows.append({
+            "category": key,
+            "depth": depth,
+            "amounts": list(amounts),
+            "diffs": list(diffs),
+            "formatted_amounts": formatter.format_many(amounts),
+            "formatted_diffs": formatter.format_many(diffs)
+        })
+    return { "names": names, "rows": rows }
+
+def diff_html(states: list[BudgetState], names: list[str], render_data: RenderOptions) -> str:
+    diff_dict = transform.generate_diff_dict([ state.category_dict for state in states ])
+    return render.diff_html(diff_dict, names, render_data)
+
+def sunburst_options(query: dict[str, list[str]]) -> tuple[Union[int, None], Union[float, None]]:
+    try:
+        top = int(query["top"][0]) if "top" in query else None
+        min_share = float(query["min_share"][0]) if "min_share" in query else None
+    except ValueError:
+        raise HTTPError(400, "top and min_share must be numbers.")
+    if top != None and top < 1:
+        raise HTTPError(400, "top must be 1 or more.")
+    if min_share != None and not 0 <= min_share < 1:
+        raise HTTPError(400, "min_share must be at least 0 and less than 1.")
+    return top, min_share
+
+def sunburst_json(state: BudgetState, top: Union[int, None], min_share: Union[float, None]) -> dict:
+    ids, parents, labels, values = transform.generate_sunburst_lists(state.report_data.expense_dict, top, min_share)
+    return { "ids": ids, "parents": parents, "labels": labels, "values": values }
+
+class Server:
+    """
+    A small HTTP/1.1 server for report, diff and sunburst data. Every
+    response closes its connection.
+
+        GET /report?file=a.budget            JSON
+        GET /report.html?file=a.budget       HTML
+        GET /diff?file=a.budget&file=b.budget
+        GET /diff.html?file=a.budget&file=b.budget
+        GET /sunburst?file=a.budget          sunburst data as JSON, also
+                                             taking top and min_share
+
+    report and diff also take currency, currency_format and
+    currency_decimals, like the command line options of the same names.
+    """
+    def __init__(self, store: BudgetStore):
+        self.store = store
+
+    async def handle(self, path: str, query: dict[str, list[str]]) -> tuple[str, Union[str, dict]]:
+        files = query.get("file", [])
+        loop = asyncio.get_running_loop()
+        if path in ("/report", "/report.html", "/sunburst"):
+            if len(files) != 1:
+                raise HTTPError(400, f"{path} takes exactly one file.")
+            state = await self.store.get(files[0])
+            if path == "/sunburst":
+                top, min_share = sunburst_options(query)
+                return "json", await loop.run_in_executor(None, sunburst_json, state, top, min_share)
+            render_data = render_options(query)
+            if path == "/report":
+                return "json", await loop.run_in_executor(None, report_json, state, render_data)
+            return "html", await loop.run_in_executor(None, report_html, state, render_data)
+        if path in ("/diff", "/diff.html"):
+            if len(files) < 2:
+                raise HTTPError(400, "Must have at least 2 files to produce a diff.")
+            states = await asyncio.gather(*(self.store.get(f) for f in files))
+            names = [ Path(f).stem for f in files ]
+            render_data = render_options(query)
+            if path == "/diff":
+                return "json", await loop.run_in_executor(None, diff_json, states, names, render_data)
+            return "html", await loop.run_in_executor(None, diff_html, states, names, render_data)
+        raise HTTPError(404, f"{path} not found.")
+
+    async def respond(self, writer: asyncio.StreamWriter, status: int, kind: str, body: Union[str, dict]):
+        if kind == "json":
+            payload = json.dumps(body).encode("utf-8")
+            content_type = "application/json"
+        else:
+            payload = body.encode("utf-8")
+            content_type = "text/html; charset=utf-8"
+        head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                "Connection: close\r\n\r\n")
+        writer.write(head.encode("ascii") + payload)
+        await writer.drain()
+
+    async def connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode("latin-1")
+            # headers are read and ignored; there are no request bodies
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            try:
+                parts = request_line.split()
+                if len(parts) != 3:
+                    raise HTTPError(400, "Malformed request.")
+                method, target, _ = parts
+                if method != "GET":
+                    raise HTTPError(405, f"{method} is not supported.")
+                url = urlsplit(target)
+                kind, body = await self.handle(unquote(url.path), parse_qs(url.query))
+                await self.respond(writer, 200, kind, body)
+            except HTTPError as e:
+                await self.respond(writer, e.status, "json", { "error": e.message })
+            except Exception as e:
+                print(f"{request_line.strip()}: {e!r}", file=sys.stderr)
+                await self.respond(writer, 500, "json", { "error": str(e) })
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+async def run(host: str, port: int, root: str, use_cache: bool = True):
+    server = Server(BudgetStore(Path(root), use_cache))
+    listener = await asyncio.start_server(server.connection, host, port)
+    for sock in listener.sockets:
+        address = sock.getsockname()
+        print(f"Serving {os.path.abspath(root)} on http://{address[0]}:{address[1]}", file=sys.stderr)
+    async with listener:
+        await listener.serve_forever()
+
+def serve(host: str = "127.0.0.1", port: int = 8080, root: str = ".", use_cache: bool = True):
+    try:
+        asyncio.run(run(host, port, root, use_cache))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,213 @@
+from dataclasses import dataclass
+from functools import reduce
+import gc
+import io
+import locale
+import os
+import sys
+from typing import Union
+from minibudget import parse
+from minibudget import transform
+from minibudget.model import Entry, ReportData
+from minibudget.selection import CategorySelector
+
+# A single large budget file is split into byte ranges which start and end
+# on line boundaries, and each range is parsed by a worker process. Ranges
+# are at most this big, so a worker never holds more than one range's text.
+MAX_SHARD_BYTES = 64 * 1024 * 1024
+
+@dataclass
+class Rollup:
+    """
+    What a rollup of a budget needs from some of its lines.
+
+    generate_category_dict only uses the last entry for each category, in
+    order of each category's first appearance, and ordered dict updates
+    keep exactly that. So the rollups of consecutive ranges merge into the
+    rollup of both with merge(), and merging is associative.
+
+    Only the last amount of each category is kept rather than its entry,
+    which makes a rollup much quicker to send back from a worker.
+    """
+    income: dict[str, int]
+    expenses: dict[str, int]
+    # income and expenses together, as rolled up for diff, with whether the
+    # last entry for each category was income
+    categories: dict[str, bool]
+    total_income: int
+    total_expenses: int
+    # parse errors, exactly as parse.budget would print them
+    errors: str
+
+    def merge(self, later: "Rollup") -> "Rollup":
+        self.income.update(later.income)
+        self.expenses.update(later.expenses)
+        self.categories.update(later.categories)
+        self.total_income += later.total_income
+        self.total_expenses += later.total_expenses
+        self.errors += later.errors
+        return self
+
+    def add(self, entries: list[Entry]):
+        income = self.income
+        expenses = self.expenses
+        categories = self.categories
+        for entry in entries:
+            key = ":".join(entry.categories)
+            categories[key] = entry.is_income
+            if entry.is_income:
+                income[key] = entry.amount
+                self.total_income += entry.amount
+            else:
+                expenses[key] = entry.amount
+                self.total_expenses += entry.amount
+
+    @staticmethod
+    def _entries(amounts: dict[str, int], is_income: bool) -> list[Entry]:
+        # parsed entries are never calculated and have no children
+        return [ Entry(key.split(":"), is_income, False, amount, []) for key, amount in amounts.items() ]
+
+    def report_data(self) -> ReportData:
+        """
+        The same ReportData as transform.entries_to_report_data, except that
+        the entries themselves aren't kept.
+        """
+        return ReportData(
+            [],
+            self.total_income,
+            transform.generate_category_dict(Rollup._entries(self.income, True)),
+            self.total_expenses,
+            transform.generate_category_dict(Rollup._entries(self.expenses, False)),
+            self.total_income + self.total_expenses
+        )
+
+    def category_dict(self) -> dict[str, Entry]:
+        entries = [
+            Entry(key.split(":"), is_income, False, (self.income if is_income else self.expenses)[key], [])
+            for key, is_income in self.categories.items()
+        ]
+        return transform.generate_category_dict(entries)
+
+def _empty(errors: str = "") -> Rollup:
+    return Rollup({}, {}, {}, 0, 0, errors)
+
+def shard_ranges(filename: str, shards: int) -> list[tuple[int, int]]:
+    """
+    Splits a file into at most `shards` byte ranges of roughly equal size,
+    each ending just after a newline or at the end of the file.
+    """
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename, "rb") as f:
+        for i in range(1, shards):
+            target = max(size * i // shards, bounds[-1])
+            f.seek(target)
+            # move the boundary to just after the next newline
+            skipped = f.readline()
+            bound = target + len(skipped)
+            if bound > bounds[-1] and bound < size:
+                bounds.append(bound)
+    bounds.append(size)
+    return [ (start, stop) for start, stop in zip(bounds, bounds[1:]) if stop > start ]
+
+def _scan(filename: str, start: int, stop: int) -> tuple[int, int]:
+    """
+    Returns the number of newlines in a range, and the number of carriage
+    returns which aren't followed by one.
+    """
+    newlines = 0
+    lone_returns = 0
+    with open(filename, "rb") as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = f.read(min(parse.BLOCK_SIZE, remaining))
+            if len(chunk) == 0:
+                break
+            if chunk.endswith(b"\r") and len(chunk) < remaining:
+                # keep \r\n together
+                chunk += f.read(1)
+            remaining -= len(chunk)
+            newlines += chunk.count(b"\n")
+            lone_returns += chunk.count(b"\r") - chunk.count(b"\r\n")
+    return newlines, lone_returns
+
+def _parse_range(
+        filename: str,
+        start: int,
+        stop: int,
+        first_line: int,
+        selector: Union[CategorySelector, None] = None
+) -> Rollup:
+    with open(filename, "rb") as f:
+        f.seek(start)
+        data = f.read(stop - start)
+    # the same decoding and newline translation as parse.budget's open()
+    text = data.decode(locale.getpreferredencoding(False))
+    del data
+    if "\r" in text:
+        text = text.replace("\r\n", "\n")
+
+    rollup = _empty()
+    errors = io.StringIO()
+    # see parse.budget
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        position = 0
+        line_number = first_line
+        while position < len(text):
+            end = text.rfind("\n", position, position + parse.BLOCK_SIZE) + 1
+            if end <= position:
+                # a line longer than a block, or the last line of the file
+                end = text.find("\n", position + parse.BLOCK_SIZE) + 1 or len(text)
+            rollup.add(parse.block(text[position:end], line_number, selector, errors))
+            line_number += text.count("\n", position, end)
+            position = end
+    finally:
+        if gc_enabled:
+            gc.enable()
+    rollup.errors = errors.getvalue()
+    return rollup
+
+def _sequential(filename: str, selector: Union[CategorySelector, None] = None) -> Rollup:
+    errors = io.StringIO()
+    entries = parse.budget(filename, selector, errors)
+    rollup = _empty(errors.getvalue())
+    rollup.add(entries)
+    return rollup
+
+def rollup(filename: str, jobs: int, selector: Union[CategorySelector, None] = None) -> Rollup:
+    """
+    Parses a budget file in up to `jobs` worker processes and rolls it up.
+    Errors are printed in the same order and with the same line numbers as
+    parse.budget prints them.
+
+    Every worker first counts the lines in its range, so that each range
+    can be parsed knowing its first line number. Files with carriage
+    returns that don't end a Windows line ending are parsed in this
+    process instead, since the lines can't be counted from newlines alone.
+    """
+    if jobs < 1:
+        raise ValueError("Jobs must be 1 or more.")
+    size = os.path.getsize(filename)
+    shards = max(jobs, -(-size // MAX_SHARD_BYTES))
+    ranges = shard_ranges(filename, shards)
+    if jobs == 1 or len(ranges) <= 1:
+        output = _sequential(filename, selector)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        starts = [ start for start, _ in ranges ]
+        stops = [ stop for _, stop in ranges ]
+        with ProcessPoolExecutor(max_workers=min(jobs, len(ranges))) as executor:
+            counts = list(executor.map(_scan, [filename] * len(ranges), starts, stops))
+            if any(lone_returns > 0 for _, lone_returns in counts):
+                output = _sequential(filename, selector)
+            else:
+                first_lines = [0]
+                for newlines, _ in counts[:-1]:
+                    first_lines.append(first_lines[-1] + newlines)
+                parts = executor.map(_parse_range, [filename] * len(ranges), starts, stops, first_lines, [selector] * len(ranges))
+                output = reduce(Rollup.merge, parts, _empty())
+    print(output.errors, end="", file=sys.stderr)
+    return output
@@ -0,0 +1,135 @@
+from array import array
+from collections.abc import Iterator, Mapping
+import sys
+from minibudget.model import Entry
+
+NO_ID = -1
+
+class CategoryStore:
+    """
+    A rolled-up category tree held in flat arrays.
+
+    Every distinct category path is interned once and given an integer id.
+    Parents and children refer to each other by id, with children kept as
+    first child / next sibling links, so no node owns a list of its own.
+    Totals follow the same rules as transform.generate_category_dict and ids
+    are assigned in the same order as that function's keys.
+    """
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+        self.paths: list[str] = []
+        self.names: list[str] = []
+        self.parents = array("l")
+        self.depths = array("l")
+        self.first_child = array("l")
+        self.last_child = array("l")
+        self.next_sibling = array("l")
+        self.amounts = array("q")
+        self.is_income = bytearray()
+        self.is_calculated = bytearray()
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def _add(self, path: str, is_income: bool, is_calculated: bool, amount: int) -> int:
+        node_id = len(self.paths)
+        cut = path.rfind(":")
+        self.ids[path] = node_id
+        self.paths.append(path)
+        self.names.append(sys.intern(path[cut + 1:]))
+        self.parents.append(NO_ID)
+        self.depths.append(path.count(":"))
+        self.first_child.append(NO_ID)
+        self.last_child.append(NO_ID)
+        self.next_sibling.append(NO_ID)
+        self.amounts.append(amount)
+        self.is_income.append(is_income)
+        self.is_calculated.append(is_calculated)
+        return node_id
+
+    def _link(self, parent_id: int, child_id: int):
+        self.parents[child_id] = parent_id
+        last = self.last_child[parent_id]
+        if last == NO_ID:
+            self.first_child[parent_id] = child_id
+        else:
+            self.next_sibling[last] = child_id
+        self.last_child[parent_id] = child_id
+
+    @classmethod
+    def from_entries(cls, entries: list[Entry]) -> "CategoryStore":
+        """
+        Build a store from parsed entries. The entries' own children lists
+        are ignored since the tree is derived from their category paths.
+        """
+        store = cls()
+        explicit: dict[str, Entry] = {}
+        for entry in entries:
+            explicit[":".join(entry.categories)] = entry
+        for path, entry in explicit.items():
+            store._add(path, entry.is_income, entry.is_calculated, entry.amount)
+
+        ids = store.ids
+        amounts = store.amounts
+        for path, entry in explicit.items():
+            child_id = ids[path]
+            cut = path.rfind(":")
+            while cut != -1:
+                if store.parents[child_id] != NO_ID:
+                    # already linked, so every ancestor exists; just add totals
+                    parent_id = store.parents[child_id]
+                    while parent_id != NO_ID:
+                        amounts[parent_id] += entry.amount
+                        parent_id = store.parents[parent_id]
+                    break
+                parent_path = path[:cut]
+                parent_id = ids.get(parent_path, NO_ID)
+                if parent_id == NO_ID:
+                    parent_id = store._add(parent_path, entry.is_income, True, entry.amount)
+                else:
+                    amounts[parent_id] += entry.amount
+                store._link(parent_id, child_id)
+                child_id = parent_id
+                cut = path.rfind(":", 0, cut)
+        return store
+
+    def children(self, node_id: int) -> Iterator[int]:
+        child_id = self.first_child[node_id]
+        while child_id != NO_ID:
+            yield child_id
+            child_id = self.next_sibling[child_id]
+
+    def roots(self) -> Iterator[int]:
+        return (node_id for node_id, parent_id in enumerate(self.parents) if parent_id == NO_ID)
+
+    def entry(self, node_id: int) -> Entry:
+        return Entry(
+            self.paths[node_id].split(":"),
+            bool(self.is_income[node_id]),
+            bool(self.is_calculated[node_id]),
+            self.amounts[node_id],
+            [ self.paths[child_id] for child_id in self.children(node_id) ]
+        )
+
+    def category_dict(self) -> "CategoryView":
+        return CategoryView(self)
+
+class CategoryView(Mapping[str, Entry]):
+    """
+    Read-only dict[str, Entry] adapter over a CategoryStore for code written
+    against generate_category_dict. Entries are built on access.
+    """
+    def __init__(self, store: CategoryStore):
+        self.store = store
+
+    def __getitem__(self, key: str) -> Entry:
+        return self.store.entry(self.store.ids[key])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.store.paths)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __contains__(self, key) -> bool:
+        return key in self.store.ids
@@ -0,0 +1,69 @@
+from collections.abc import Callable, Iterator
+import heapq
+from itertools import groupby
+import pickle
+import tempfile
+from typing import BinaryIO
+from minibudget.store import CategoryStore
+
+# Rows held in memory across all files while merging. Each file's cursor
+# reads its sorted rows back in batches of this divided by the file count.
+MERGE_BUFFER_ROWS = 1 << 16
+
+def _sort_key(key: str) -> list[str]:
+    # comparing split paths puts every category straight after its parent,
+    # which comparing strings doesn't ("A B" sorts between "A" and "A:B")
+    return key.split(":")
+
+def _write_run(spill: BinaryIO, store: CategoryStore, batch_size: int) -> int:
+    """
+    Appends a file's categories to the spill file in sorted order, in
+    pickled batches of (key, amount). Returns where the run starts.
+    """
+    start = spill.tell()
+    paths = store.paths
+    amounts = store.amounts
+    order = sorted(range(len(paths)), key=lambda node_id: _sort_key(paths[node_id]))
+    for i in range(0, len(order), batch_size):
+        batch = [ (paths[node_id], amounts[node_id]) for node_id in order[i:i + batch_size] ]
+        pickle.dump(batch, spill, protocol=pickle.HIGHEST_PROTOCOL)
+    # an empty batch marks the end of the run
+    pickle.dump([], spill, protocol=pickle.HIGHEST_PROTOCOL)
+    return start
+
+def _read_run(spill: BinaryIO, offset: int, period: int) -> Iterator[tuple[list[str], str, int, int]]:
+    # every run shares one file, so each cursor remembers its own position
+    while True:
+        spill.seek(offset)
+        batch = pickle.load(spill)
+        offset = spill.tell()
+        if len(batch) == 0:
+            return
+        for key, amount in batch:
+            yield _sort_key(key), key, period, amount
+
+def diff_rows(files: list[str], load: Callable[[str], CategoryStore]) -> Iterator[tuple[str, int, list[int]]]:
+    """
+    Yields (key, depth, amounts) for every category in any of the files, with
+    one amount per file and 0 where a file doesn't have the category.
+
+    Each file is loaded and rolled up into a CategoryStore with `load` one at
+    a time, then written to a temporary file in sorted order. The rows come from a k-way merge
+    over those sorted runs, so only one file's categories, one batch per
+    file and the current row are in memory at once. Categories come out in
+    depth-first order with the children of each category sorted by name.
+    """
+    batch_size = max(16, MERGE_BUFFER_ROWS // max(1, len(files)))
+    with tempfile.TemporaryFile() as spill:
+        starts = []
+        for filename in files:
+            spill.seek(0, 2)
+            starts.append(_write_run(spill, load(filename), batch_size))
+
+        runs = [ _read_run(spill, start, period) for period, start in enumerate(starts) ]
+        merged = heapq.merge(*runs, key=lambda item: item[0])
+        for key, items in groupby(merged, key=lambda item: item[1]):
+            amounts = [0] * len(files)
+            for _, _, period, amount in items:
+                amounts[period] = amount
+            yield key, key.count(":"), amounts
@@ -1,6 +1,5 @@
 from typing import Union
 from minibudget.model import Entry, ReportData, DiffTreeNode
-from copy import deepcopy
 
 def calculate_total(entries: list[Entry]) -> int:
     total = 0
@@ -16,32 +15,49 @@ def calculate_total(entries: list[Entry]) -> int:
 # without the algorithmic complexity of storing the information
 # as a tree; instead we're using a method similar to a DAG
 # representation in the dictionary.
+#
+# Each entry is walked up its path once using the colon positions in its key,
+# and children are kept in dicts used as ordered sets, so the rollup is linear
+# in the number of entries times their depth however wide a category is.
 def generate_category_dict(entries: list[Entry]) -> dict[str, Entry]:
     base_output: dict[str, Entry] = {}
     for entry in entries:
         key = ":".join(entry.categories)
         base_output[key] = entry
-   
-    output = deepcopy(base_output) 
+
+    output: dict[str, Entry] = {}
+    children: dict[str, dict[str, None]] = {}
+    for key, entry in base_output.items():
+        output[key] = Entry(entry.categories.copy(),
+                            entry.is_income,
+                            entry.is_calculated,
+                            entry.amount,
+                            []
+                            )
+        children[key] = dict.fromkeys(entry.children)
+
     for entry_key, entry in base_output.items():
-        categories = entry_key.split(":")
         last_category = entry_key
-        for i in range(1, len(categories)):
-            parent_categories = categories[:-i]
-            category_key = ":".join(parent_categories)
-            if category_key in output:
-                output[category_key].amount += entry.amount
-                if last_category not in output[category_key].children:
-                    output[category_key].children.append(last_category)
-                last_category = category_key
-                continue
-            output[category_key] = Entry(parent_categories,
-                                         entry.is_income,
-                                         True, 
-                                         entry.amount,
-                                         [last_category]
-                                         )
+        cut = entry_key.rfind(":")
+        while cut != -1:
+            category_key = entry_key[:cut]
+            parent = output.get(category_key)
+            if parent is None:
+                output[category_key] = Entry(category_key.split(":"),
+                                             entry.is_income,
+                                             True,
+                                             entry.amount,
+                                             []
+                                             )
+                children[category_key] = { last_category: None }
+            else:
+                parent.amount += entry.amount
+                children[category_key][last_category] = None
             last_category = category_key
+            cut = entry_key.rfind(":", 0, cut)
+
+    for key, category in output.items():
+        category.children = list(children[key])
     return output
 
 def generate_diff_dict(category_dicts: list[dict[str, Entry]]) -> dict[str, list[Union[Entry, None]]]:
@@ -53,17 +69,31 @@ def generate_diff_dict(category_dicts: list[dict[str, Entry]]) -> dict[str, list
             diff_dict[key][dict_i] = entry
     return diff_dict
 
+def partition_entries(entries: list[Entry]) -> tuple[list[Entry], list[Entry]]:
+    """
+    Splits entries into (income, expenses) in one pass.
+    """
+    income_entries = []
+    expense_entries = []
+    for entry in entries:
+        if entry.is_income:
+            income_entries.append(entry)
+        else:
+            expense_entries.append(entry)
+    return income_entries, expense_entries
+
 def entries_to_report_data(entries: list[Entry]) -> ReportData:
-    income_entries = list(filter(lambda e: e.is_income, entries))
-    expense_entries = list(filter(lambda e: not e.is_income, entries))
+    income_entries, expense_entries = partition_entries(entries)
+    total_income = calculate_total(income_entries)
+    total_expenses = calculate_total(expense_entries)
     
     report_data = ReportData(
         entries,
-        calculate_total(income_entries),
+        total_income,
         generate_category_dict(income_entries),
-        calculate_total(expense_entries),
+        total_expenses,
         generate_category_dict(expense_entries),
-        calculate_total(entries)
+        total_income + total_expenses
     )
     return report_data
 
@@ -88,3 +118,61 @@ def generate_triple_list(entries: list[Entry]) -> tuple[list[str],list[str],list
         else:
             parent_list.append("")
     return (parent_list, label_list, value_list)
+
+def generate_sunburst_lists(
+        category_dict: dict[str, Entry],
+        top: Union[int, None] = None,
+        min_share: Union[float, None] = None
+) -> tuple[list[str], list[str], list[str], list[int]]:
+    """
+    Returns (ids, parents, labels, values) for a sunburst chart of a category
+    dict. Ids and parents are full category paths, so categories with the
+    same name under different parents stay apart.
+
+    Under each category only the `top` largest children are kept, and any
+    child smaller than `min_share` of the whole chart is dropped. Dropped
+    children and everything below them are added together into one "Other"
+    node under their parent, so the chart's totals don't change.
+    """
+    values = { key: abs(entry.amount) for key, entry in category_dict.items() }
+    roots = [ key for key in category_dict if ":" not in key ]
+    total = sum(values[key] for key in roots)
+    threshold = total * min_share if min_share != None else None
+
+    ids = []
+    parent_list = []
+    label_list = []
+    value_list = []
+    # (parent, children) pairs still to add, depth first
+    stack = [ ("", roots) ]
+    while len(stack) > 0:
+        parent, children = stack.pop()
+        if top != None or threshold != None:
+            # largest first, so the children to keep are always a prefix
+            children = sorted(children, key=values.__getitem__, reverse=True)
+            keep = len(children) if top == None else min(top, len(children))
+            if threshold != None:
+                while keep > 0 and values[children[keep - 1]] < threshold:
+                    keep -= 1
+            kept, other = children[:keep], children[keep:]
+        else:
+            kept, other = children, []
+
+        for key in kept:
+            ids.append(key)
+            parent_list.append(parent)
+            label_list.append(category_dict[key].categories[-1])
+            value_list.append(values[key])
+        if len(other) > 0:
+            other_id = f"{parent}:Other" if parent != "" else "Other"
+            while other_id in category_dict:
+                other_id += "*"
+            ids.append(other_id)
+            parent_list.append(parent)
+            label_list.append("Other")
+            value_list.append(sum(values[key] for key in other))
+        for key in reversed(kept):
+            children = category_dict[key].children
+            if len(children) > 0:
+                stack.append((key, children))
+    return (ids, parent_list, label_list, value_list)
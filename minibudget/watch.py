@@ -0,0 +1,355 @@
+from bisect import bisect_left, insort
+from collections.abc import Callable
+from itertools import islice, repeat
+from operator import is_not, itemgetter
+import os
+import time
+from typing import Union
+from minibudget import parse
+from minibudget import transform
+from minibudget.model import Entry
+
+def _read_lines(filename: str) -> list[str]:
+    with open(filename) as f:
+        text = f.read()
+    # keep the newline on each line so that a line gaining or losing its
+    # newline at the end of the file counts as a change
+    lines = text.split("\n")
+    last = lines.pop()
+    lines = [ ln + "\n" for ln in lines ]
+    if len(last) > 0:
+        lines.append(last)
+    return lines
+
+def _key(entry: Entry) -> tuple[bool, str]:
+    # income and expenses are rolled up separately, so a category repeats
+    # only if it repeats on the same side
+    return (entry.is_income, ":".join(entry.categories))
+
+# Each line gets a rank which orders it within the file. Ranks start this far
+# apart, so lines inserted later can be ranked between their neighbours
+# without renumbering the rest of the file.
+RANK_GAP = 1 << 32
+# Edits which change more than this share of the entries rebuild the report,
+# which is quicker than applying that many changes one at a time.
+REBUILD_SHARE = 0.5
+
+_rank = itemgetter(0)
+
+class IncrementalReport:
+    """
+    Keeps the ReportData for a budget file up to date as the file changes.
+
+    Only lines which differ from the previous version are parsed. Removed
+    and added entries are applied to their categories and ancestors in
+    place, creating and deleting calculated parents as needed, so an edit
+    costs about the same however big the file is. Only very large edits
+    rebuild the category dicts, from the already parsed entries.
+
+    Categories keep the order transform.generate_category_dict gives them:
+    children in the order of the first line anywhere below them, and top
+    level categories written in the budget before calculated ones.
+
+    With a selector, lines for categories it doesn't accept are treated as
+    if they couldn't be parsed.
+    """
+    def __init__(self, filename: str, selector: Union[Callable[[str], bool], None] = None):
+        self.filename = filename
+        self.selector = selector
+        self.lines: list[str] = []
+        self.line_entries: list[Union[Entry, None]] = []
+        self.line_ranks: list[int] = []
+        # (rank, entry) for each line of a category, in file order; the last
+        # one is the entry which counts towards the category tree
+        self.occurrences: dict[tuple[bool, str], list[tuple[int, Entry]]] = {}
+        # the rank of the first line in or below each category
+        self.first_ranks: dict[tuple[bool, str], int] = {}
+        # top level categories of each side, in the same order as the dicts
+        self.roots: dict[bool, list[str]] = {}
+        self.signature = self._stat()
+        self.lines = _read_lines(filename)
+        self.line_entries = parse.block_lines("".join(self.lines), 0, selector)
+        self._rebuild()
+
+    def _stat(self) -> Union[tuple[int, int], None]:
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _category_dict(self, is_income: bool) -> dict[str, Entry]:
+        return self.report_data.income_dict if is_income else self.report_data.expense_dict
+
+    def _rebuild(self):
+        entries = []
+        self.line_ranks = [ (i + 1) * RANK_GAP for i in range(len(self.line_entries)) ]
+        self.occurrences = {}
+        for rank, entry in zip(self.line_ranks, self.line_entries):
+            if entry is not None:
+                entries.append(entry)
+                self.occurrences.setdefault(_key(entry), []).append((rank, entry))
+        self.report_data = transform.entries_to_report_data(entries)
+
+        self.first_ranks = {}
+        for (is_income, path), occurrences in self.occurrences.items():
+            rank = occurrences[0][0]
+            cut = len(path)
+            while cut != -1:
+                key = (is_income, path[:cut])
+                if self.first_ranks.get(key, rank + 1) < rank:
+                    # an earlier line is below it, and so below its ancestors
+                    break
+                self.first_ranks[key] = rank
+                cut = path.rfind(":", 0, cut)
+        self.roots = {
+            is_income: [ key for key in self._category_dict(is_income) if ":" not in key ]
+            for is_income in (True, False)
+        }
+
+    def _ranks(self, start: int, stop: int, count: int) -> Union[list[int], None]:
+        """
+        Ranks for `count` lines replacing lines start to stop, or None if
+        there's no room left between their neighbours.
+        """
+        low = self.line_ranks[start - 1] if start > 0 else 0
+        if stop < len(self.line_ranks):
+            high = self.line_ranks[stop]
+        else:
+            high = low + (count + 1) * RANK_GAP
+        step = (high - low) // (count + 1)
+        if step == 0:
+            return None
+        return [ low + step * (i + 1) for i in range(count) ]
+
+    def _own_amount(self, key: tuple[bool, str]) -> int:
+        occurrences = self.occurrences.get(key)
+        return occurrences[-1][1].amount if occurrences else 0
+
+    def _add_amount(self, key: tuple[bool, str], delta: int):
+        """
+        Adds `delta` to a category and its ancestors, creating any of them
+        which don't exist yet.
+        """
+        is_income, path = key
+        category_dict = self._category_dict(is_income)
+        # a category created on the last step, still to be added to its parent
+        unlinked = None
+        cut = len(path)
+        while cut != -1:
+            category_key = path[:cut]
+            category = category_dict.get(category_key)
+            created = category is None
+            if created:
+                # only the category itself can be written in the budget
+                is_calculated = True if cut != len(path) else self.occurrences[key][-1][1].is_calculated
+                category = Entry(category_key.split(":"), is_income, is_calculated, 0, [])
+                category_dict[category_key] = category
+                if ":" not in category_key:
+                    self.roots[is_income].append(category_key)
+            if unlinked is not None:
+                category.children.append(unlinked)
+            category.amount += delta
+            unlinked = category_key if created else None
+            cut = path.rfind(":", 0, cut)
+
+    def _remove(self, key: tuple[bool, str]):
+        """
+        Deletes a category with no lines and no children, and any calculated
+        parents left without children.
+        """
+        is_income, path = key
+        category_dict = self._category_dict(is_income)
+        while True:
+            del category_dict[path]
+            self.first_ranks.pop((is_income, path), None)
+            cut = path.rfind(":")
+            if cut == -1:
+                self.roots[is_income].remove(path)
+                return
+            parent_path = path[:cut]
+            parent = category_dict[parent_path]
+            parent.children.remove(path)
+            if len(parent.children) > 0 or (is_income, parent_path) in self.occurrences:
+                return
+            path = parent_path
+
+    def _settle(self, key: tuple[bool, str], delta: int):
+        """
+        Brings a category's amount in line with its lines after some of them
+        were added or removed, given the change in its own amount. Categories
+        left with no lines and no children are deleted later by _remove.
+        """
+        is_income, path = key
+        category = self._category_dict(is_income).get(path)
+        occurrences = self.occurrences.get(key)
+        if occurrences is not None:
+            if category is not None:
+                category.is_calculated = occurrences[-1][1].is_calculated
+        elif category is None:
+            return
+        else:
+            category.is_calculated = True
+        self._add_amount(key, delta)
+
+    def _first_rank(self, key: tuple[bool, str], category: Entry) -> int:
+        is_income, _ = key
+        occurrences = self.occurrences.get(key)
+        ranks = [ self.first_ranks[(is_income, child)] for child in category.children ]
+        if occurrences is not None:
+            ranks.append(occurrences[0][0])
+        return min(ranks)
+
+    def _root_order(self, is_income: bool, path: str) -> tuple[int, int]:
+        occurrences = self.occurrences.get((is_income, path))
+        if occurrences is not None:
+            return (0, occurrences[0][0])
+        return (1, self.first_ranks[(is_income, path)])
+
+    @staticmethod
+    def _in_order(items: list[str], item: str, order: Callable[[str], tuple]) -> bool:
+        # only an item whose order changed can be out of place, so it's
+        # enough to compare it with its neighbours
+        i = items.index(item)
+        position = order(item)
+        if i > 0 and not order(items[i - 1]) < position:
+            return False
+        return i == len(items) - 1 or position < order(items[i + 1])
+
+    def _reorder(self, changed: set[tuple[bool, str]]):
+        """
+        Updates the first ranks of the changed categories and their
+        ancestors, then puts any category whose rank moved it back in order.
+        """
+        keys: set[tuple[bool, str]] = set()
+        for is_income, path in changed:
+            cut = len(path)
+            while cut != -1:
+                key = (is_income, path[:cut])
+                if key in keys:
+                    break
+                keys.add(key)
+                cut = path.rfind(":", 0, cut)
+
+        moved: dict[tuple[bool, str], list[str]] = {}
+        # children first, since a category's rank comes from theirs
+        for key in sorted(keys, key=lambda key: key[1].count(":"), reverse=True):
+            is_income, path = key
+            category = self._category_dict(is_income).get(path)
+            if category is None:
+                continue
+            rank = self._first_rank(key, category)
+            if ":" not in path:
+                # the order of top level categories also depends on which are
+                # written in the budget, so always check them
+                self.first_ranks[key] = rank
+                moved.setdefault((is_income, ""), []).append(path)
+            elif self.first_ranks.get(key) != rank:
+                self.first_ranks[key] = rank
+                moved.setdefault((is_income, path[:path.rfind(":")]), []).append(path)
+
+        for (is_income, parent_path), children in moved.items():
+            if parent_path == "":
+                order = lambda path: self._root_order(is_income, path)
+                roots = self.roots[is_income]
+                if not all(IncrementalReport._in_order(roots, path, order) for path in children):
+                    roots.sort(key=order)
+                    # roots are listed in dict order, so move them to the end
+                    # of the dict in their new order
+                    category_dict = self._category_dict(is_income)
+                    for path in roots:
+                        category_dict[path] = category_dict.pop(path)
+                continue
+            siblings = self._category_dict(is_income)[parent_path].children
+            order = lambda path: self.first_ranks[(is_income, path)]
+            if not all(IncrementalReport._in_order(siblings, path, order) for path in children):
+                siblings.sort(key=order)
+
+    def _apply(self, removed: list[tuple[int, Entry]], added: list[tuple[int, Entry]]):
+        data = self.report_data
+        own_amounts: dict[tuple[bool, str], int] = {}
+        for _, entry in removed + added:
+            key = _key(entry)
+            if key not in own_amounts:
+                own_amounts[key] = self._own_amount(key)
+
+        for rank, entry in removed:
+            key = _key(entry)
+            occurrences = self.occurrences[key]
+            del occurrences[bisect_left(occurrences, rank, key=_rank)]
+            if len(occurrences) == 0:
+                del self.occurrences[key]
+        for rank, entry in added:
+            insort(self.occurrences.setdefault(_key(entry), []), (rank, entry), key=_rank)
+
+        total_delta = { True: 0, False: 0 }
+        for _, entry in removed:
+            total_delta[entry.is_income] -= entry.amount
+        for _, entry in added:
+            total_delta[entry.is_income] += entry.amount
+        data.total_income += total_delta[True]
+        data.total_expenses += total_delta[False]
+        data.total_unassigned += total_delta[True] + total_delta[False]
+
+        for key, own_amount in own_amounts.items():
+            self._settle(key, self._own_amount(key) - own_amount)
+        # only once every amount is settled, since deleting a category can
+        # delete parents which have their own lines to settle
+        for key in own_amounts:
+            is_income, path = key
+            category = self._category_dict(is_income).get(path)
+            if category is not None and key not in self.occurrences and len(category.children) == 0:
+                self._remove(key)
+        self._reorder(set(own_amounts))
+
+    def update(self) -> bool:
+        """
+        Re-reads the file if it has changed since the last call. Returns True
+        if the report data may have changed.
+        """
+        signature = self._stat()
+        if signature is None or signature == self.signature:
+            return False
+        self.signature = signature
+        lines = _read_lines(self.filename)
+
+        old_lines = self.lines
+        limit = min(len(old_lines), len(lines))
+        start = 0
+        while start < limit and old_lines[start] == lines[start]:
+            start += 1
+        end = 0
+        while end < limit - start and old_lines[-1 - end] == lines[-1 - end]:
+            end += 1
+
+        old_stop = len(old_lines) - end
+        new_stop = len(lines) - end
+        removed = [
+            (rank, entry)
+            for rank, entry in zip(self.line_ranks[start:old_stop], self.line_entries[start:old_stop])
+            if entry is not None
+        ]
+        changed = parse.block_lines("".join(lines[start:new_stop]), start, self.selector)
+        ranks = self._ranks(start, old_stop, len(changed))
+        added = [ (rank, entry) for rank, entry in zip(ranks or [], changed) if entry is not None ]
+        # where the changed lines' entries are in report_data.entries
+        # (compared by identity, since comparing entries to None is slow)
+        offset = sum(map(is_not, islice(self.line_entries, start), repeat(None)))
+
+        self.lines = lines
+        self.line_entries[start:old_stop] = changed
+        entries = self.report_data.entries
+        if ranks is None or len(removed) + len(added) > len(entries) * REBUILD_SHARE:
+            self._rebuild()
+            return True
+        self.line_ranks[start:old_stop] = ranks
+        entries[offset:offset + len(removed)] = [ entry for _, entry in added ]
+        self._apply(removed, added)
+        return True
+
+    def wait(self, interval: float = 0.5):
+        """
+        Polls the file every `interval` seconds until it changes.
+        """
+        while not self.update():
+            time.sleep(interval)